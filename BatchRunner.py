@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from Benchmark import load_game_module, ScriptedInput
+
+POLICIES = ('random', 'scripted')
+
+# Game module and headless game of a worker process. The game is created once by the pool initializer, which loads
+# sprites from the atlas cache, and restarted for every playthrough
+worker_module = None
+worker_game = None
+
+
+class PlaythroughObserver:
+    """ Input policy wrapper that counts deaths and kills of a playthrough and ends it when the level is cleared """
+    def __init__(self, policy):
+        self.policy = policy
+        self.deaths = 0
+        self.kills = 0
+        self.clear_tick = None
+
+        self.player_dead = False
+        self.enemy_count = None
+
+    def __call__(self, game, tick):
+        if game.player.dead and not self.player_dead:
+            self.deaths += 1
+        self.player_dead = game.player.dead
+
+        # Enemy count only goes up when the level is reloaded after a death
+        enemy_count = len(game.enemies)
+        if self.enemy_count is not None and enemy_count < self.enemy_count:
+            self.kills += self.enemy_count - enemy_count
+        self.enemy_count = enemy_count
+
+        if not enemy_count:
+            self.clear_tick = tick
+            return None
+        return self.policy(game, tick)
+
+
+def init_worker():
+    """ Create the headless game of a worker process. Headless games never initialize the mixer or open a window """
+    global worker_module, worker_game
+    worker_module = load_game_module()
+    worker_game = worker_module.Game(headless=True, seed=0)
+
+
+def run_playthrough(task):
+    """ Play a level with a seed until it's cleared or the tick limit is reached. Returns the playthrough statistics """
+    level, seed, ticks, policy_name = task
+    worker_game.restart(seed, level)
+    policy = worker_module.RandomPolicy(seed) if policy_name == 'random' else ScriptedInput()
+    observer = PlaythroughObserver(policy)
+    stats = worker_game.run_headless(ticks, observer)
+
+    return {
+        'level': level,
+        'seed': seed,
+        'policy': policy_name,
+        'cleared': observer.clear_tick is not None,
+        'deaths': observer.deaths,
+        'kills': observer.kills,
+        'clear_seconds': observer.clear_tick / worker_module.TICK_RATE if observer.clear_tick is not None else None,
+        'ticks': stats['ticks'],
+        'ticks_per_second': stats['ticks_per_second']
+    }
+
+
+def summarize_level(results):
+    """ Returns aggregated statistics of the playthroughs of a level """
+    clear_seconds = [result['clear_seconds'] for result in results if result['cleared']]
+    return {
+        'playthroughs': len(results),
+        'clear_rate': len(clear_seconds) / len(results),
+        'mean_deaths': float(np.mean([result['deaths'] for result in results])),
+        'mean_kills': float(np.mean([result['kills'] for result in results])),
+        'median_clear_seconds': float(np.median(clear_seconds)) if clear_seconds else None,
+        'mean_ticks_per_second': float(np.mean([result['ticks_per_second'] for result in results]))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyNinja batch playthrough runner')
+    parser.add_argument('--levels', type=int, nargs='*', default=None, help='levels to play, all levels by default')
+    parser.add_argument('--seeds', type=int, default=100, help='playthroughs per level, seeded 0 to seeds - 1')
+    parser.add_argument('--ticks', type=int, default=36000, help='tick limit of a playthrough')
+    parser.add_argument('--policy', choices=POLICIES, default='random', help='input policy of the player')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--output', default='batch.jsonl', help='path of the json lines file results are streamed to')
+    args = parser.parse_args()
+
+    # Level maps are named map<level>.json, like in the game
+    level_count = len([file_name for file_name in os.listdir('assets/maps') if file_name.endswith('.json')])
+    levels = args.levels if args.levels is not None else list(range(level_count))
+    tasks = [(level, seed, args.ticks, args.policy) for level in levels for seed in range(args.seeds)]
+
+    results = {level: [] for level in levels}
+    start_time = time.perf_counter()
+    output_file = open(args.output, 'w')
+    pool = multiprocessing.Pool(args.workers, initializer=init_worker)
+    # Results arrive in the order playthroughs finish and are written as soon as they arrive
+    for i, result in enumerate(pool.imap_unordered(run_playthrough, tasks)):
+        results[result['level']].append(result)
+        output_file.write(json.dumps(result) + '\n')
+        output_file.flush()
+        clear = f"cleared in {result['clear_seconds']:.1f}s" if result['cleared'] else 'not cleared'
+        print(f"[{i + 1}/{len(tasks)}] level {result['level']} seed {result['seed']}: {clear}, "
+              f"{result['deaths']} deaths, {result['kills']} kills, {result['ticks_per_second']:.0f} ticks/s")
+    # Workers are let to exit on their own. Terminating them would wait forever on workers that ignore SIGTERM
+    pool.close()
+    pool.join()
+    output_file.close()
+
+    print(f'{len(tasks)} playthroughs in {time.perf_counter() - start_time:.1f}s')
+    for level in levels:
+        summary = summarize_level(results[level])
+        clear_seconds = f"{summary['median_clear_seconds']:.1f}s" if summary['median_clear_seconds'] is not None else '-'
+        print(f"level {level}: cleared {summary['clear_rate'] * 100:.0f}%, median time to clear {clear_seconds}, "
+              f"{summary['mean_deaths']:.2f} deaths, {summary['mean_kills']:.2f} kills, {summary['mean_ticks_per_second']:.0f} ticks/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import importlib.util
+
+import numpy as np
+import pygame
+
+from scripts.Entities.PhysicsEntity import PhysicsEntity
+from scripts.Entities.BatchPhysics import update_physics
+
+# Profiler scopes of the frame loop reported per frame. Each scope covers update and render of its subsystem
+SUBSYSTEMS = ('streaming', 'clouds', 'tilemap', 'enemies', 'player', 'projectiles', 'sparks', 'particles', 'transition', 'present')
+
+# Synthetic stress maps as (name, width in tiles, enemy count)
+STRESS_MAPS = (('stress_100', 300, 100), ('stress_400', 1000, 400))
+
+
+def load_game_module():
+    """ Import PyNinja.py as a module without starting the game """
+    spec = importlib.util.spec_from_file_location('PyNinja', 'PyNinja.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_stress_map(path, width, enemy_count):
+    """ Write a flat map with platforms, leaf spawning trees and evenly spread enemies to a json file """
+    floor_y = 15
+    grid_tiles = {}
+
+    def add_tile(tile_type, variant, x, y):
+        grid_tiles[str(x) + ';' + str(y)] = {'type': tile_type, 'variant': variant, 'pos': [x, y]}
+
+    for x in range(width):
+        add_tile('grass', 1, x, floor_y)
+        add_tile('stone', 1, x, floor_y + 1)
+        # Platforms above the floor
+        if x % 12 < 5:
+            add_tile('grass', 1, x, floor_y - 5)
+    # Walls at both ends keep entities on the map
+    for y in range(floor_y - 12, floor_y):
+        add_tile('stone', 1, 0, y)
+        add_tile('stone', 1, width - 1, y)
+
+    offgrid_tiles = [{'type': 'spawners', 'variant': 0, 'pos': [32.0, floor_y * 16 - 15.0]}]
+    for i in range(enemy_count):
+        offgrid_tiles.append({'type': 'spawners', 'variant': 1, 'pos': [64.0 + i * (width - 6) * 16 / enemy_count, floor_y * 16 - 15.0]})
+    for x in range(10, width - 10, 20):
+        offgrid_tiles.append({'type': 'large_decor', 'variant': 2, 'pos': [x * 16.0, floor_y * 16 - 44.0]})
+
+    map_file = open(path, 'w')
+    json.dump({'tile_size': 16, 'grid_tiles': grid_tiles, 'offgrid_tiles': offgrid_tiles}, map_file)
+    map_file.close()
+
+
+class ScriptedInput:
+    """ Deterministic input that runs back and forth, jumps and dashes on a fixed schedule """
+    def __call__(self, game, tick):
+        cycle_tick = tick % 240
+        return cycle_tick >= 120, cycle_tick < 120, tick % 40 == 0, tick % 90 == 10
+
+
+def summarize(samples):
+    """ Returns mean and percentiles of a list of samples """
+    samples = np.array(samples, dtype=float)
+    return {'mean': float(samples.mean()), 'p50': float(np.percentile(samples, 50)),
+            'p95': float(np.percentile(samples, 95)), 'p99': float(np.percentile(samples, 99)),
+            'max': float(samples.max())}
+
+
+def step(game, policy, tick):
+    game.profiler.begin_frame()
+    if game.scheduler:
+        game.scheduler.reset_counters()
+    game.apply_input(*policy(game, tick))
+    game.update()
+    game.render()
+    game.profiler.end_frame()
+
+
+def load_map_game(game_module, map_path, seed, **game_options):
+    """ Returns a headless game playing a map """
+    game = game_module.Game(headless=True, seed=seed, **game_options)
+    # Restricting the level list to the benchmarked map makes deaths and level clears reload the same map
+    game.map_paths = [map_path]
+    game.level = 0
+    game.load_level(0)
+    return game
+
+
+def check_batch_physics(game_module, map_path, seed, entity_count=200, ticks=600):
+    """ Move the same entities through a map one by one and in batch. Returns the first tick where their positions,
+        velocities, collision states, cached rects or facing differ, or None if they match on every tick """
+    game = load_map_game(game_module, map_path, seed)
+    rng = random.Random(seed)
+    tile_size = game.tilemap.tile_size
+    grid = game.tilemap.grid
+
+    # Entities start anywhere on the map, including inside solid tiles
+    single = []
+    batch = []
+    for i in range(entity_count):
+        pos = ((grid.origin_x + rng.random() * grid.width) * tile_size, (grid.origin_y + rng.random() * grid.height) * tile_size)
+        single.append(PhysicsEntity('enemy', game, pos, (8, 15)))
+        batch.append(PhysicsEntity('enemy', game, pos, (8, 15)))
+
+    for tick in range(ticks):
+        movements = []
+        for single_entity, batch_entity in zip(single, batch):
+            movements.append((rng.choice((-1, -0.5, 0, 0, 0.5, 1)), 0))
+            # Occasional dash and jump sized velocities
+            if rng.random() < 0.05:
+                single_entity.velocity[0] = batch_entity.velocity[0] = rng.uniform(-8, 8)
+            if rng.random() < 0.05:
+                single_entity.velocity[1] = batch_entity.velocity[1] = -rng.uniform(0, 3)
+
+        for entity, movement in zip(single, movements):
+            entity.update(game.tilemap, movement)
+        update_physics(batch, movements, game.tilemap)
+
+        for single_entity, batch_entity in zip(single, batch):
+            if (single_entity.pos != batch_entity.pos or single_entity.velocity != batch_entity.velocity
+                    or single_entity.collisions != batch_entity.collisions or single_entity.flip != batch_entity.flip
+                    or single_entity.rect != batch_entity.rect or batch_entity.rect != pygame.Rect(batch_entity.pos, batch_entity.size)):
+                return tick
+    return None
+
+
+def check_projectiles(game_module, map_path, seed, projectile_count=200, ticks=600):
+    """ Fly projectiles across a map and test rects around them with collide_rect and with every projectile position.
+        Returns the first tick where they find different hits, or None if they match on every tick """
+    game = load_map_game(game_module, map_path, seed)
+    rng = random.Random(seed)
+    tile_size = game.tilemap.tile_size
+    grid = game.tilemap.grid
+    projectiles = game.projectiles
+
+    for tick in range(ticks):
+        # Projectiles fly both ways from anywhere on the map, including across negative coordinates
+        while len(projectiles) < projectile_count:
+            pos = ((grid.origin_x + rng.random() * grid.width) * tile_size, (grid.origin_y + rng.random() * grid.height) * tile_size)
+            projectiles.spawn(pos, (rng.choice((-1.5, 1.5)), 0), lifespan=rng.randint(30, 360))
+        projectiles.update(game.tilemap)
+
+        for i in range(10):
+            x, y = projectiles.pos[rng.randrange(len(projectiles))].tolist() if len(projectiles) else (0, 0)
+            rect = pygame.Rect(int(x) - rng.randint(0, 16), int(y) - rng.randint(0, 16), 8, 15)
+            pos = projectiles.pos[:len(projectiles)]
+            expected = int(np.count_nonzero((pos[:, 0] >= rect.left) & (pos[:, 0] < rect.right)
+                                            & (pos[:, 1] >= rect.top) & (pos[:, 1] < rect.bottom)))
+            if projectiles.collide_rect(rect) != expected:
+                return tick
+    return None
+
+
+def benchmark_entities(game_module, map_path, seed, entity_count=400, ticks=300):
+    """ Micro-benchmark of PhysicsEntity. Returns memory per entity, and time, peak allocation and memory blocks left
+        allocated per entity update """
+    game = load_map_game(game_module, map_path, seed)
+    rng = random.Random(seed)
+    tile_size = game.tilemap.tile_size
+    grid = game.tilemap.grid
+    positions = [((grid.origin_x + rng.random() * grid.width) * tile_size, (grid.origin_y + rng.random() * grid.height) * tile_size)
+                 for i in range(entity_count)]
+    movements = [[(rng.choice((-1, -0.5, 0, 0.5, 1)), 0) for i in range(entity_count)] for tick in range(ticks)]
+
+    tracemalloc.start()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    entities = [PhysicsEntity('enemy', game, pos, (8, 15)) for pos in positions]
+    entity_bytes = (tracemalloc.get_traced_memory()[0] - start_memory) / entity_count
+    tracemalloc.stop()
+
+    start_time = time.perf_counter()
+    for tick_movements in movements:
+        for entity, movement in zip(entities, tick_movements):
+            entity.update(game.tilemap, movement)
+    update_us = (time.perf_counter() - start_time) / (ticks * entity_count) * 1e6
+
+    # Allocations are measured in a separate pass, since tracing slows down every allocation. The peak is taken per
+    # update, since objects allocated by one update are freed before the next one
+    alloc_bytes = []
+    net_blocks = []
+    tracemalloc.start()
+    for tick_movements in movements:
+        start_blocks = sys.getallocatedblocks()
+        for entity, movement in zip(entities, tick_movements):
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+            entity.update(game.tilemap, movement)
+            alloc_bytes.append(tracemalloc.get_traced_memory()[1] - start_memory)
+        net_blocks.append((sys.getallocatedblocks() - start_blocks) / entity_count)
+    tracemalloc.stop()
+
+    return {'entity_bytes': entity_bytes, 'update_us': update_us, 'alloc_peak_bytes_per_update': summarize(alloc_bytes),
+            'net_blocks_per_update': summarize(net_blocks)}
+
+
+def benchmark_map(game_module, map_path, frames, warmup, seed, batch_physics=False, streaming=False, lod=False):
+    """ Run a map with scripted input and return frame time, subsystem time, allocation and, with level of detail,
+        enemy update statistics """
+    game = load_map_game(game_module, map_path, seed, batch_physics=batch_physics, streaming=streaming, lod=lod)
+    policy = ScriptedInput()
+
+    for tick in range(warmup):
+        step(game, policy, tick)
+
+    frame_times = []
+    subsystem_times = {subsystem: [] for subsystem in SUBSYSTEMS}
+    enemy_updates = {'full': [], 'reduced': [], 'frozen': []}
+    # Hitches are reported through the percentiles, so the profiler never dumps during a benchmark
+    game.profiler.hitch_threshold_ms = float('inf')
+    game.profiler.enabled = True
+    for tick in range(warmup, warmup + frames):
+        step(game, policy, tick)
+        frame = game.profiler.frames[-1]
+        frame_times.append(frame['frame_ms'])
+        for subsystem in SUBSYSTEMS:
+            subsystem_times[subsystem].append(frame['scopes_ms'].get(subsystem, 0.0))
+        if game.scheduler:
+            enemy_updates['full'].append(game.scheduler.full_updates)
+            enemy_updates['reduced'].append(game.scheduler.reduced_updates)
+            enemy_updates['frozen'].append(game.scheduler.frozen)
+    game.profiler.enabled = False
+
+    # Allocations are measured in a separate pass, since tracing slows down every allocation
+    alloc_bytes = []
+    net_blocks = []
+    tracemalloc.start()
+    for tick in range(warmup + frames, warmup + 2 * frames):
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        start_blocks = sys.getallocatedblocks()
+        step(game, policy, tick)
+        alloc_bytes.append(tracemalloc.get_traced_memory()[1] - start_memory)
+        net_blocks.append(sys.getallocatedblocks() - start_blocks)
+    tracemalloc.stop()
+
+    result = {
+        'frame_ms': summarize(frame_times),
+        'subsystem_ms': {subsystem: summarize(times) for subsystem, times in subsystem_times.items()},
+        # Peak of memory allocated on top of the memory in use at the start of a frame
+        'alloc_peak_bytes_per_frame': summarize(alloc_bytes),
+        # Memory blocks allocated and not yet released by the end of a frame
+        'net_blocks_per_frame': summarize(net_blocks),
+        'entities': {'enemies': len(game.enemies), 'particles': len(game.particles), 'sparks': len(game.sparks),
+                     'projectiles': len(game.projectiles)}
+    }
+    if game.scheduler:
+        result['enemy_updates_per_frame'] = {kind: summarize(counts) for kind, counts in enemy_updates.items()}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyNinja frame loop benchmark')
+    parser.add_argument('--frames', type=int, default=600, help='measured frames per map')
+    parser.add_argument('--warmup', type=int, default=60, help='frames run before measuring')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the game random number generator')
+    parser.add_argument('--maps', nargs='*', default=None, help='names of maps to run, e.g. map0 stress_100')
+    parser.add_argument('--output', default='benchmark.json', help='path of the json report')
+    parser.add_argument('--batch-physics', action='store_true', help='move enemies in one vectorized step')
+    parser.add_argument('--stream', action='store_true', help='page grid chunks of maps in and out instead of loading them whole')
+    parser.add_argument('--lod', action='store_true', help='update enemies far from the view at a reduced rate')
+    parser.add_argument('--check-physics', action='store_true',
+                        help='check that batch physics matches per-entity physics and that projectile collisions find every '
+                             'hit on every map instead of benchmarking')
+    parser.add_argument('--entities', action='store_true',
+                        help='micro-benchmark memory, update time and allocations of entities on every map instead')
+    args = parser.parse_args()
+
+    game_module = load_game_module()
+
+    stress_dir = tempfile.mkdtemp(prefix='pyninja_stress_')
+    map_paths = {}
+    for file_name in sorted(os.listdir('assets/maps')):
+        if file_name.endswith('.json'):
+            map_paths[os.path.splitext(file_name)[0]] = os.path.join('assets/maps', file_name)
+    for name, width, enemy_count in STRESS_MAPS:
+        map_paths[name] = os.path.join(stress_dir, name + '.json')
+        generate_stress_map(map_paths[name], width, enemy_count)
+
+    if args.check_physics:
+        mismatches = 0
+        for name, map_path in map_paths.items():
+            if args.maps and name not in args.maps:
+                continue
+            tick = check_batch_physics(game_module, map_path, args.seed)
+            print(f'{name:12} ' + ('batch physics matches' if tick is None else f'batch physics differs at tick {tick}'))
+            mismatches += tick is not None
+            tick = check_projectiles(game_module, map_path, args.seed)
+            print(f'{name:12} ' + ('projectile collisions match' if tick is None else f'projectile collisions differ at tick {tick}'))
+            mismatches += tick is not None
+        sys.exit(1 if mismatches else 0)
+
+    if args.entities:
+        for name, map_path in map_paths.items():
+            if args.maps and name not in args.maps:
+                continue
+            result = benchmark_entities(game_module, map_path, args.seed)
+            print(f"{name:12} {result['entity_bytes']:6.0f}B/entity  update {result['update_us']:5.2f}us  "
+                  f"alloc {result['alloc_peak_bytes_per_update']['mean']:6.1f}B/update  "
+                  f"{result['net_blocks_per_update']['mean']:5.2f} blocks/update")
+        return
+
+    report = {
+        'meta': {'python': platform.python_version(), 'pygame': pygame.version.ver, 'numpy': np.__version__,
+                 'platform': platform.platform(), 'frames': args.frames, 'warmup': args.warmup, 'seed': args.seed,
+                 'batch_physics': args.batch_physics, 'streaming': args.stream, 'lod': args.lod},
+        'maps': {}
+    }
+    for name, map_path in map_paths.items():
+        if args.maps and name not in args.maps:
+            continue
+        result = benchmark_map(game_module, map_path, args.frames, args.warmup, args.seed, args.batch_physics, args.stream, args.lod)
+        report['maps'][name] = result
+        frame_ms = result['frame_ms']
+        print(f"{name:12} p50 {frame_ms['p50']:6.2f}ms  p95 {frame_ms['p95']:6.2f}ms  p99 {frame_ms['p99']:6.2f}ms  "
+              f"alloc {result['alloc_peak_bytes_per_frame']['mean'] / 1024:7.1f}KiB/frame")
+        if args.lod:
+            updates = result['enemy_updates_per_frame']
+            print(f"{'':12} {updates['full']['mean']:.1f} full, {updates['reduced']['mean']:.1f} reduced updates and "
+                  f"{updates['frozen']['mean']:.1f} frozen enemies per frame")
+
+    output_file = open(args.output, 'w')
+    json.dump(report, output_file, indent=2)
+    output_file.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,62 +1,131 @@
 import sys
 import os
 import math
+import time
+import zlib
 import random
+import argparse
 import pygame
+from concurrent.futures import ThreadPoolExecutor
 
 from scripts.Entities.Player import Player
 from scripts.Entities.Enemy import Enemy
-from scripts.Tilemap import Tilemap
+from scripts.Entities.BatchPhysics import update_physics, MIN_BATCH_SIZE
+from scripts.LevelLoader import LevelLoader
 from scripts.Cloud import Clouds
 from scripts.Animation import Animation
-from scripts.Utils import load_sprite, load_sprites
-from scripts.ParticleSystem import Particle
-from scripts.Spark import Spark
+from scripts.Utils import SilentSound
+from scripts.SpriteAtlas import SpriteAtlas
+from scripts.ParticleSystem import ParticleSystem
+from scripts.EmitterSystem import EmitterSystem
+from scripts.Spark import Spark, SparkSystem
+from scripts.Projectile import ProjectileSystem
+from scripts.SpatialHash import SpatialHash
+from scripts.Profiler import Profiler, ProfilerOverlay
+from scripts.Presenter import Presenter, SCALING_MODES
+from scripts.Replay import ReplayWriter, ReplayReader
+from scripts.UpdateScheduler import UpdateScheduler
+
+# Simulation runs at a fixed rate independent of the render rate
+TICK_RATE = 60
+TICK_TIME = 1 / TICK_RATE
+# Most simulation ticks run before a frame is rendered. Time beyond it is dropped so slow frames can't snowball
+MAX_CATCH_UP_STEPS = 5
+
+# Enemies are only rendered if their collision rect is within this many pixels of the view, which covers their
+# sprite and gun
+RENDER_MARGIN = 32
+
+# Frames with more dirty rects than this are presented whole, since updating many small areas costs more than one large
+MAX_DIRTY_RECTS = 64
 
 
 class Game:
-    def __init__(self):
-        """ Initialize pygame and setup game properties """
-        pygame.init()
-
-        # Set game window resolution, title and icon
-        self.window = pygame.display.set_mode((840, 630))
-        pygame.display.set_icon(pygame.image.load('assets/images/icon.png'))
-        pygame.display.set_caption('PyNinja')
+    def __init__(self, headless=False, seed=None, profile=False, scaling='stretch', fullscreen=False, dirty_rendering=False,
+                 max_fps=60, level=0, batch_physics=False, streaming=False, stream_budget=16 * 1024 * 1024,
+                 lod=False):
+        """ Initialize pygame and setup game properties. Headless game runs without window, audio and rendering """
+        self.headless = headless
+
+        # Timing scopes of the frame loop. Recording only happens while the profiler is enabled
+        self.profiler = Profiler(enabled=profile)
+
+        # Every random roll of the simulation goes through this generator, so a seed reproduces a run. Set by restart
+        self.seed = None
+        self.rng = None
+
+        if self.headless:
+            # Dummy video driver is still needed to convert sprites to the display format, and lets tools render offscreen
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+            # SDL turns SIGTERM into a quit event, which a headless game never handles, so it couldn't be terminated
+            os.environ['SDL_NO_SIGNAL_HANDLERS'] = '1'
+            pygame.display.init()
+        else:
+            pygame.init()
+
+        # Set game window resolution, title and icon. Presenter owns the window and the surfaces the viewport is scaled
+        # into, F11 toggles fullscreen and F4 switches the scaling mode
+        self.presenter = Presenter((320, 240), (840, 630), scaling, fullscreen)
+        self.window = self.presenter.window
+        if not self.headless:
+            pygame.display.set_icon(pygame.image.load('assets/images/icon.png'))
+            pygame.display.set_caption('PyNinja')
 
         # Game is rendered on this surface, and it's later scaled to match windows size
         self.viewport = pygame.Surface((320, 240))
 
+        # Dirty rendering keeps background, clouds and tiles on the static layer and only restores and presents the areas
+        # moving objects were drawn on, while the camera rests
+        self.dirty_rendering = dirty_rendering
+        self.static_layer = pygame.Surface(self.viewport.get_size())
+        self.last_render_scroll = None
+        self.cloud_rects = []
+        self.dirty_rects = []
+
         self.clock = pygame.time.Clock()
+        # Render rate cap of the game loop, 0 renders as fast as possible
+        self.max_fps = max_fps
+        # Simulation ticks run for the last rendered frame
+        self.simulation_steps = 0
+
+        # F3 toggles the overlay drawing frame times and live object counts on the viewport
+        self.profiler_overlay = ProfilerOverlay(self.profiler)
+
+        # Every sprite is a subsurface of a few atlas pages, which are loaded from a cache file when it is up to date
+        atlas = SpriteAtlas()
+        atlas.load()
 
         # Dictionary to store game asset objects mapped to their name string as key
         self.assets = {
-            'background': load_sprite('background.png'),
-            'grass': load_sprites('tiles/grass'),
-            'stone': load_sprites('tiles/stone'),
-            'clouds': load_sprites('clouds'),
-            'decor': load_sprites('tiles/decor'),
-            'spawners': load_sprites('tiles/spawners'),
-            'gun': load_sprite('gun.png'),
-            'bullet': load_sprite('projectile.png'),
-            'large_decor': load_sprites('tiles/large_decor'),
-            'player/idle': Animation(load_sprites('entities/player/idle'), sprite_duration=6),
-            'player/run': Animation(load_sprites('entities/player/run'), sprite_duration=4),
-            'player/jump': Animation(load_sprites('entities/player/jump')),
-            'player/wall_slide': Animation(load_sprites('entities/player/wall_slide')),
-            'enemy/idle': Animation(load_sprites('entities/enemy/idle'), sprite_duration=6),
-            'enemy/run': Animation(load_sprites('entities/enemy/run'), sprite_duration=4),
-            'particle/leaf': Animation(load_sprites('particles/leaf'), sprite_duration=16, loop=False),
-            'particle/particle': Animation(load_sprites('particles/particle'), sprite_duration=6, loop=False)
+            'background': atlas.load_sprite('background.png'),
+            'grass': atlas.load_sprites('tiles/grass'),
+            'stone': atlas.load_sprites('tiles/stone'),
+            'clouds': atlas.load_sprites('clouds'),
+            'decor': atlas.load_sprites('tiles/decor'),
+            'spawners': atlas.load_sprites('tiles/spawners'),
+            'gun': atlas.load_sprite('gun.png'),
+            'gun/flipped': pygame.transform.flip(atlas.load_sprite('gun.png'), True, False),
+            'bullet': atlas.load_sprite('projectile.png'),
+            'large_decor': atlas.load_sprites('tiles/large_decor'),
+            'player/idle': Animation(atlas.load_sprites('entities/player/idle'), sprite_duration=6),
+            'player/run': Animation(atlas.load_sprites('entities/player/run'), sprite_duration=4),
+            'player/jump': Animation(atlas.load_sprites('entities/player/jump')),
+            'player/wall_slide': Animation(atlas.load_sprites('entities/player/wall_slide')),
+            'enemy/idle': Animation(atlas.load_sprites('entities/enemy/idle'), sprite_duration=6),
+            'enemy/run': Animation(atlas.load_sprites('entities/enemy/run'), sprite_duration=4),
+            'particle/leaf': Animation(atlas.load_sprites('particles/leaf'), sprite_duration=16, loop=False),
+            'particle/particle': Animation(atlas.load_sprites('particles/particle'), sprite_duration=6, loop=False)
         }
 
         # Dictionary to store game sound effects mapped to their name string as key
+        sound = SilentSound if self.headless else pygame.mixer.Sound
         self.sfx = {
-            'ambience': pygame.mixer.Sound('assets/sfx/ambience.wav'),
-            'dash': pygame.mixer.Sound('assets/sfx/dash.wav'),
-            'hit': pygame.mixer.Sound('assets/sfx/hit.wav'),
-            'jump': pygame.mixer.Sound('assets/sfx/jump.wav'),
-            'shoot': pygame.mixer.Sound('assets/sfx/shoot.wav')
+            'ambience': sound('assets/sfx/ambience.wav'),
+            'dash': sound('assets/sfx/dash.wav'),
+            'hit': sound('assets/sfx/hit.wav'),
+            'jump': sound('assets/sfx/jump.wav'),
+            'shoot': sound('assets/sfx/shoot.wav')
         }
 
         self.sfx['ambience'].set_volume(0.3)
@@ -69,74 +138,211 @@ class Game:
 
         # Movement state on x-axis
         self.movement_x = [False, False]
+        # Jump and dash key presses waiting for the next simulation tick
+        self.jump_pressed = False
+        self.dash_pressed = False
+
+        # Input of every tick is streamed to the recorder while recording
+        self.recorder = None
 
-        # Camera
+        # Camera. Scroll at the start of the last simulation tick is kept for interpolation
         self.camera_scroll = [0, 0]
+        self.prev_camera_scroll = [0, 0]
         self.screen_shake_strength = 0
+        self.screen_shake_offset = (0, 0)
 
-        self.tilemap = Tilemap(self)
+        # Tilemap of the current level, swapped in by load_level
+        self.tilemap = None
 
-        self.clouds = Clouds(self.assets['clouds'])
+        self.clouds = None
 
         self.enemies = []
+        # Batch physics moves every enemy through the tilemap in one vectorized step instead of one by one. Walking,
+        # shooting and hit checks still run per enemy, before and after the step
+        self.batch_physics = batch_physics
+        # Level of detail updates enemies far from the view at a reduced rate and freezes the farthest ones
+        self.scheduler = UpdateScheduler() if lod else None
+        # Broadphase for entity collisions, kept up to date by PhysicsEntity.update
+        self.entity_hash = SpatialHash()
 
-        self.projectiles = []
+        self.projectiles = ProjectileSystem(self.assets['bullet'])
 
         # Particle System
-        self.particles = []
-        self.leaf_Spawner = []
-        self.sparks = []
+        self.particles = ParticleSystem(self)
+        # Falling leaves of the trees in the level, spawned only near the camera
+        self.emitters = EmitterSystem(self)
+        self.sparks = SparkSystem()
 
         self.respawn_timer = 0
         self.transition_timer = 0
 
-        self.level = 0
+        # Level maps are named map<level>.json. Binary maps generated next to them are not separate levels
+        level_count = len([file_name for file_name in os.listdir('assets/maps') if file_name.endswith('.json')])
+        self.map_paths = [f'assets/maps/map{level}.json' for level in range(level_count)]
+
+        # Streaming pages grid chunks of large maps in from chunked map files instead of loading whole maps. Chunks
+        # around the camera and entities are read ahead on their own thread, and pages beyond the budget in bytes are evicted
+        self.streaming = streaming
+        self.stream_budget = stream_budget
+        self.chunk_reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ChunkReader') if streaming else None
+
+        # Levels are parsed and indexed on a worker thread while the previous level is played
+        self.level_loader = LevelLoader(self)
+
+        self.level = level
+        self.restart(seed, level)
+
+    def restart(self, seed=None, level=0):
+        """ Start over at a level with a new seed, reusing loaded assets and levels. Plays the same as a game created
+            with the seed and level. Unseeded games pick a seed, so they can be recorded too """
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+
+        self.clouds = Clouds(self.assets['clouds'], self.rng)
+
+        self.movement_x = [False, False]
+        self.jump_pressed = False
+        self.dash_pressed = False
+        self.screen_shake_strength = 0
+        self.screen_shake_offset = (0, 0)
+        self.projectiles.clear()
+
+        self.level = level
         self.load_level(self.level)
 
     def load_level(self, map_id):
-        self.tilemap.load_map(f'assets/maps/map{map_id}.json')
+        level = self.level_loader.get(self.map_paths[map_id])
+        self.tilemap = level.tilemap
 
-        self.particles = []
-        self.sparks = []
+        # Keep the current level prepared for respawns and start preparing the next one
+        next_map_path = self.map_paths[min(map_id + 1, len(self.map_paths) - 1)]
+        self.level_loader.keep({level.path, next_map_path})
+        self.level_loader.preload(next_map_path)
+
+        self.particles.clear()
+        self.sparks.clear()
 
         self.camera_scroll = [0, 0]
+        self.prev_camera_scroll = [0, 0]
 
         self.respawn_timer = 0
         self.transition_timer = -30
 
-        self.leaf_Spawner = []
-        for tree in self.tilemap.get_tiles([('large_decor', 2)], destroy=False):
-            self.leaf_Spawner.append(pygame.Rect(4 + tree['pos'][0], 4 + tree['pos'][1], 23, 13))
+        # A tree drops leaves from its crown, on average one for every 99999 square pixels of it per tick
+        self.emitters.clear()
+        for tree in level.trees:
+            rect = pygame.Rect(4 + tree['pos'][0], 4 + tree['pos'][1], 23, 13)
+            self.emitters.spawn(rect, 'leaf', rect.width * rect.height / 99999, velocity=(-0.1, 0.3), frames=(0, 17))
 
         self.enemies = []
-        for spawner in self.tilemap.get_tiles([('spawners', 0), ('spawners', 1)], destroy=True):
+        self.entity_hash.clear()
+        if self.scheduler:
+            self.scheduler.clear()
+        for spawner in level.spawners:
             if spawner['variant'] == 0:
                 self.player = Player(self, list(spawner['pos']), (8, 15))
                 self.player.dead = False
+                self.entity_hash.insert(self.player, self.player.get_collision_rect())
             else:
                 self.enemies.append(Enemy(self, spawner['pos'], (8, 15)))
-
-    def run(self):
-        """ Main game loop """
-        pygame.mixer.music.load('assets/music.wav')
-        pygame.mixer.music.set_volume(0.5)
-        pygame.mixer.music.play(-1)
-        self.sfx['ambience'].play(-1)
-
-        while True:
-            self.viewport.blit(self.assets['background'], (0, 0))
-
-            self.screen_shake_strength = max(0, self.screen_shake_strength - 1)
-
-            self.camera_scroll[0] += (self.player.get_collision_rect().centerx - self.viewport.get_width() / 2 - self.camera_scroll[0]) / 30
-            self.camera_scroll[1] += (self.player.get_collision_rect().centery - self.viewport.get_height() / 2 - self.camera_scroll[1]) / 30
-            render_scroll = (int(self.camera_scroll[0]), int(self.camera_scroll[1]))
-
+                self.entity_hash.insert(self.enemies[-1], self.enemies[-1].get_collision_rect())
+
+    def handle_events(self):
+        """ Apply keyboard input to the player """
+        for event in pygame.event.get():
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_a:
+                    self.movement_x[0] = True
+                if event.key == pygame.K_d:
+                    self.movement_x[1] = True
+                if event.key == pygame.K_SPACE:
+                    self.jump_pressed = True
+                if event.key == pygame.K_x:
+                    self.dash_pressed = True
+                if event.key == pygame.K_F3:
+                    self.profiler_overlay.toggle()
+                if event.key == pygame.K_F4:
+                    self.presenter.next_scaling()
+                if event.key == pygame.K_F11:
+                    self.presenter.toggle_fullscreen()
+                    self.window = self.presenter.window
+            if event.type == pygame.KEYUP:
+                if event.key == pygame.K_a:
+                    self.movement_x[0] = False
+                if event.key == pygame.K_d:
+                    self.movement_x[1] = False
+            if event.type == pygame.VIDEORESIZE:
+                self.presenter.handle_event(event)
+                self.window = self.presenter.window
+            if event.type == pygame.QUIT:
+                self.stop_recording()
+                pygame.quit()
+                sys.exit()
+
+    def apply_input(self, left, right, jump, dash):
+        """ Apply input of a simulation tick. Jump and dash are triggered on the ticks they are pressed """
+        if self.recorder:
+            self.recorder.record(self, left, right, jump, dash)
+        self.movement_x = [left, right]
+        if jump:
+            self.player.jump()
+        if dash:
+            self.player.dash()
+
+    def start_recording(self, path):
+        """ Record input of every following tick to a replay file. Must start before the first tick to replay """
+        self.recorder = ReplayWriter(path, self.seed, self.level, self.batch_physics, self.scheduler is not None)
+
+    def stop_recording(self):
+        if self.recorder:
+            self.recorder.close(self)
+            self.recorder = None
+
+    def get_checksum(self):
+        """ Returns a checksum of the simulation state, used to detect replays diverging from their recording """
+        state = (self.level, self.player.pos, self.player.velocity, self.player.dead, self.player.dash_timeframe,
+                 [(enemy.pos, enemy.velocity) for enemy in self.enemies], self.projectiles.pos[:len(self.projectiles)].tolist(),
+                 self.rng.getstate())
+        return zlib.crc32(repr(state).encode())
+
+    def get_counters(self):
+        """ Returns live object counts reported by the profiler """
+        counters = {'enemies': len(self.enemies), 'particles': len(self.particles), 'sparks': len(self.sparks),
+                    'projectiles': len(self.projectiles), 'emitters': len(self.emitters.active),
+                    'steps': self.simulation_steps}
+        if self.tilemap.streaming:
+            counters['chunks'] = len(self.tilemap.grid.pages)
+        if self.scheduler:
+            counters['full_updates'] = self.scheduler.full_updates
+            counters['reduced_updates'] = self.scheduler.reduced_updates
+            counters['frozen'] = self.scheduler.frozen
+        return counters
+
+    def update(self):
+        """ Advance the game simulation by one tick """
+        profiler = self.profiler
+
+        self.prev_camera_scroll[0] = self.camera_scroll[0]
+        self.prev_camera_scroll[1] = self.camera_scroll[1]
+
+        self.screen_shake_strength = max(0, self.screen_shake_strength - 1)
+        # Shake offset is rolled during the simulation, so rendering doesn't consume random numbers
+        self.screen_shake_offset = (self.rng.random() * self.screen_shake_strength - self.screen_shake_strength / 2,
+                                    self.rng.random() * self.screen_shake_strength - self.screen_shake_strength / 2)
+
+        self.camera_scroll[0] += (self.player.get_collision_rect().centerx - self.viewport.get_width() / 2 - self.camera_scroll[0]) / 30
+        self.camera_scroll[1] += (self.player.get_collision_rect().centery - self.viewport.get_height() / 2 - self.camera_scroll[1]) / 30
+
+        if self.tilemap.streaming:
+            with profiler.scope('streaming'):
+                camera_velocity = (self.camera_scroll[0] - self.prev_camera_scroll[0], self.camera_scroll[1] - self.prev_camera_scroll[1])
+                self.tilemap.stream(pygame.Rect(self.camera_scroll, self.viewport.get_size()), camera_velocity,
+                                    [self.player.pos] + [enemy.pos for enemy in self.enemies])
+
+        with profiler.scope('clouds'):
             self.clouds.update()
-            self.clouds.render(self.viewport, render_scroll)
-
-            self.tilemap.render(self.viewport, render_scroll)
 
+        with profiler.scope('transition'):
             if self.player.dead:
                 self.respawn_timer += 1
                 if self.respawn_timer >= 10:
@@ -147,102 +353,284 @@ class Game:
             if not len(self.enemies):
                 self.transition_timer += 1
                 if self.transition_timer > 30:
-                    self.level = min(self.level + 1, len(os.listdir('assets/maps')) - 1)
+                    self.level = min(self.level + 1, len(self.map_paths) - 1)
                     self.load_level(self.level)
             if self.transition_timer < 0:
                 self.transition_timer += 1
 
-            for enemy in self.enemies.copy():
-                kill = enemy.update(self.tilemap, (0, 0))
-                enemy.render(self.viewport, render_scroll)
-
-                if kill:
-                    self.enemies.remove(enemy)
-
+        with profiler.scope('enemies'):
+            # Without level of detail every enemy is updated for this tick
+            if self.scheduler:
+                enemies, merged = self.scheduler.schedule(self.enemies, pygame.Rect(self.camera_scroll, self.viewport.get_size()))
+            else:
+                enemies, merged = self.enemies, ()
+
+            # Batch physics gives the same results as updating enemies one by one, so it's only used where it's faster
+            if self.batch_physics and len(enemies) >= MIN_BATCH_SIZE:
+                movements = [enemy.pre_physics_update(self.tilemap, (0, 0)) for enemy in enemies]
+                update_physics(enemies, movements, self.tilemap)
+                for enemy, movement in zip(enemies, movements):
+                    enemy.post_physics_update(movement)
+            else:
+                for enemy in enemies:
+                    enemy.update(self.tilemap, (0, 0))
+
+            for enemy, steps in merged:
+                enemy.update(self.tilemap, (0, 0), steps)
+
+            # Enemies touched by a dashing player are killed. They are found with a single query once every enemy has
+            # moved, instead of every enemy querying the player rect
+            if abs(self.player.dash_timeframe) >= 50:
+                for entity in self.entity_hash.query(self.player.get_collision_rect()):
+                    if entity is not self.player:
+                        entity.hit()
+                        self.enemies.remove(entity)
+                        self.entity_hash.remove(entity)
+
+        with profiler.scope('player'):
             if not self.player.dead:
                 # Booleans implicitly converts to integers when arithmetic operation are performed on them
                 self.player.update(self.tilemap, (self.movement_x[1] - self.movement_x[0], 0))
-                self.player.render(self.viewport, render_scroll)
-
-            # Projectile is represented as dictionary {pos, velocity, lifespan}
-            for projectile in self.projectiles.copy():
-                projectile['pos'][0] += projectile['velocity']
-                projectile['lifespan'] -= 1
-                bullet_sprite = self.assets['bullet']
-                self.viewport.blit(bullet_sprite, (projectile['pos'][0] - bullet_sprite.get_width() / 2 - render_scroll[0],
-                                                        projectile['pos'][1] - bullet_sprite.get_height() / 2 - render_scroll[1]))
-                if projectile['lifespan'] == 0:
-                    self.projectiles.remove(projectile)
-                elif self.tilemap.check_solid_tile(projectile['pos']):
-                    self.projectiles.remove(projectile)
-                    for i in range(4):
-                        self.sparks.append(Spark(projectile['pos'], random.random() - 0.5 + (math.pi if projectile['velocity'] > 0 else 0), random.random() + 2))
-                elif abs(self.player.dash_timeframe) < 50:
-                    if self.player.get_collision_rect().collidepoint(projectile['pos']):
-                        self.projectiles.remove(projectile)
-                        self.sfx['hit'].play()
-                        self.screen_shake_strength = max(16, self.screen_shake_strength)
-                        self.player.dead = True
-                        for i in range(30):
-                            angle = random.random() * math.pi * 2
-                            speed = random.random() * 5
-                            self.sparks.append(Spark(self.player.get_collision_rect().center, angle, 2 + random.random()))
-                            self.particles.append(Particle(self, 'particle', self.player.get_collision_rect().center,
-                                                           [math.cos(angle + math.pi) * speed * 0.5, math.sin(angle + math.pi) * speed * 0.5], random.randint(0, 3)))
-
-            for spark in self.sparks.copy():
-                kill = spark.update()
-                spark.render(self.viewport, offset=render_scroll)
-                if kill:
-                    self.sparks.remove(spark)
-
-            for rect in self.leaf_Spawner:
-                if random.random() * 99999 < rect.width * rect.height:
-                    pos = (rect.x + random.random() * rect.width, rect.y + random.random() * rect.height)
-                    self.particles.append(Particle(self, 'leaf', pos, velocity=[-0.1, 0.3], frame=random.randint(0, 17)))
-
-            for particle in self.particles.copy():
-                destroy = particle.update()
-                particle.render(self.viewport, render_scroll)
-                if particle.type == 'leaf':
-                    # Using property of sine wave to imitate swaying effect on the leaf particles
-                    particle.pos[0] += math.sin(particle.animation.current_frame * 0.04) * 0.3
-                if destroy:
-                    self.particles.remove(particle)
-
-            for event in pygame.event.get():
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_a:
-                        self.movement_x[0] = True
-                    if event.key == pygame.K_d:
-                        self.movement_x[1] = True
-                    if event.key == pygame.K_SPACE:
-                        self.player.jump()
-                    if event.key == pygame.K_x:
-                        self.player.dash()
-                if event.type == pygame.KEYUP:
-                    if event.key == pygame.K_a:
-                        self.movement_x[0] = False
-                    if event.key == pygame.K_d:
-                        self.movement_x[1] = False
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
 
+        with profiler.scope('projectiles'):
+            for pos, velocity in self.projectiles.update(self.tilemap):
+                for i in range(4):
+                    self.sparks.append(Spark(pos, self.rng.random() - 0.5 + (math.pi if velocity[0] > 0 else 0), self.rng.random() + 2))
+
+            # Player is immune to projectiles while dashing
+            if abs(self.player.dash_timeframe) < 50:
+                if self.projectiles.collide_rect(self.player.get_collision_rect()):
+                    self.sfx['hit'].play()
+                    self.screen_shake_strength = max(16, self.screen_shake_strength)
+                    self.player.dead = True
+                    for i in range(30):
+                        angle = self.rng.random() * math.pi * 2
+                        speed = self.rng.random() * 5
+                        self.sparks.append(Spark(self.player.get_collision_rect().center, angle, 2 + self.rng.random()))
+                        self.particles.spawn('particle', self.player.get_collision_rect().center,
+                                             (math.cos(angle + math.pi) * speed * 0.5, math.sin(angle + math.pi) * speed * 0.5), self.rng.randint(0, 3))
+
+        with profiler.scope('sparks'):
+            self.sparks.update()
+
+        with profiler.scope('particles'):
+            self.emitters.update(pygame.Rect(self.camera_scroll, self.viewport.get_size()))
+
+            self.particles.update()
+
+    def render_static_layer(self, render_scroll, rects=None):
+        """ Render background, clouds and tiles to the static layer, or only inside the rects if they are passed """
+        profiler = self.profiler
+        for rect in rects if rects is not None else (None,):
+            self.static_layer.set_clip(rect)
+            with profiler.scope('clouds'):
+                self.static_layer.blit(self.assets['background'], (0, 0))
+                self.clouds.render(self.static_layer, render_scroll)
+
+            with profiler.scope('tilemap'):
+                self.tilemap.render(self.static_layer, render_scroll)
+        self.static_layer.set_clip(None)
+
+    def render(self, alpha=1.0):
+        """ Render the current game state to the viewport and present it in the window. Alpha interpolates camera,
+            entities and projectiles from the start (0) to the end (1) of the last simulation tick """
+        profiler = self.profiler
+        render_scroll = (int(self.camera_scroll[0] - (self.camera_scroll[0] - self.prev_camera_scroll[0]) * (1 - alpha)),
+                         int(self.camera_scroll[1] - (self.camera_scroll[1] - self.prev_camera_scroll[1]) * (1 - alpha)))
+
+        # Rects of the viewport changed since the last frame, or None if the whole viewport is redrawn
+        changed_rects = None
+        dirty_rects = None
+        if not self.dirty_rendering:
+            with profiler.scope('clouds'):
+                self.viewport.blit(self.assets['background'], (0, 0))
+                self.clouds.render(self.viewport, render_scroll)
+
+            with profiler.scope('tilemap'):
+                self.tilemap.render(self.viewport, render_scroll)
+        else:
+            dirty_rects = []
+            cloud_rects = self.clouds.get_render_rects(self.viewport.get_size(), render_scroll)
+            # Camera movement, screen shake, transitions and the profiler overlay change the whole viewport
+            if (render_scroll != self.last_render_scroll or self.screen_shake_offset != (0, 0) or self.transition_timer
+                    or self.profiler_overlay.visible):
+                self.render_static_layer(render_scroll)
+                self.viewport.blit(self.static_layer, (0, 0))
+            else:
+                # Clouds drift across the static layer, so it is redrawn where they moved
+                static_rects = []
+                for last_rect, rect in zip(self.cloud_rects, cloud_rects):
+                    if last_rect != rect:
+                        static_rects += [last_rect, rect]
+                self.render_static_layer(render_scroll, static_rects)
+
+                # Objects drawn in the last frame are erased by restoring the static layer under them
+                changed_rects = static_rects + self.dirty_rects
+                self.viewport.blits([(self.static_layer, rect, rect) for rect in changed_rects], doreturn=False)
+            self.cloud_rects = cloud_rects
+            self.last_render_scroll = render_scroll
+
+        with profiler.scope('enemies'):
+            view_rect = pygame.Rect(render_scroll, self.viewport.get_size()).inflate(2 * RENDER_MARGIN, 2 * RENDER_MARGIN)
+            for enemy in self.enemies:
+                if view_rect.colliderect(enemy.get_render_rect(alpha)):
+                    enemy.render(self.viewport, render_scroll, dirty_rects, alpha)
+
+        with profiler.scope('player'):
+            if not self.player.dead:
+                self.player.render(self.viewport, render_scroll, dirty_rects, alpha)
+
+        with profiler.scope('projectiles'):
+            self.projectiles.render(self.viewport, render_scroll, dirty_rects, alpha)
+
+        with profiler.scope('sparks'):
+            self.sparks.render(self.viewport, render_scroll, dirty_rects)
+
+        with profiler.scope('particles'):
+            self.particles.render(self.viewport, render_scroll, dirty_rects)
+
+        with profiler.scope('transition'):
             if self.transition_timer:
-                transition_surf = pygame.Surface(self.viewport.get_size())
-                pygame.draw.circle(transition_surf, (255, 255, 255), (self.viewport.get_width() // 2, self.viewport.get_height() // 2), (30 - abs(self.transition_timer)) * 8)
-                transition_surf.set_colorkey((255, 255, 255))
-                self.viewport.blit(transition_surf, (0, 0))
+                self.viewport.blit(self.presenter.get_transition_mask((30 - abs(self.transition_timer)) * 8), (0, 0))
+
+        self.profiler_overlay.render(self.viewport)
 
-            screen_shake_offset = (random.random() * self.screen_shake_strength - self.screen_shake_strength / 2,
-                                   random.random() * self.screen_shake_strength - self.screen_shake_strength / 2)
+        if changed_rects is not None:
+            changed_rects += dirty_rects
+            if len(changed_rects) > MAX_DIRTY_RECTS:
+                changed_rects = None
+        self.dirty_rects = dirty_rects
 
-            # Viewport is rendered in the main window and is scaled to match its size to mimic a zoomed-in effect
-            self.window.blit(pygame.transform.scale(self.viewport, self.window.get_size()), screen_shake_offset)
+        with profiler.scope('present'):
+            self.present(changed_rects)
 
-            pygame.display.update()
-            self.clock.tick(60)
+    def present(self, rects=None):
+        """ Scale the viewport to the window and flip the display. Only the viewport rects are presented if passed """
+        # Viewport is rendered in the main window and is scaled to match its size to mimic a zoomed-in effect
+        self.presenter.present(self.viewport, self.screen_shake_offset, rects)
 
+    def run(self, policy=None):
+        """ Main game loop. Input comes from the keyboard, or from policy if it's passed (see run_headless), and the
+            loop returns when policy runs out of input """
+        pygame.mixer.music.load('assets/music.wav')
+        pygame.mixer.music.set_volume(0.5)
+        pygame.mixer.music.play(-1)
+        self.sfx['ambience'].play(-1)
 
-Game().run()
+        tick = 0
+        accumulator = 0.0
+        last_time = time.perf_counter()
+        while True:
+            self.profiler.begin_frame()
+            with self.profiler.scope('events'):
+                self.handle_events()
+
+            # Run every simulation tick that fell due since the last frame
+            current_time = time.perf_counter()
+            accumulator += current_time - last_time
+            last_time = current_time
+            self.simulation_steps = 0
+            if self.scheduler:
+                self.scheduler.reset_counters()
+            while accumulator >= TICK_TIME and self.simulation_steps < MAX_CATCH_UP_STEPS:
+                if policy:
+                    tick_input = policy(self, tick)
+                    if tick_input is None:
+                        return
+                else:
+                    tick_input = (self.movement_x[0], self.movement_x[1], self.jump_pressed, self.dash_pressed)
+                    self.jump_pressed = self.dash_pressed = False
+                self.apply_input(*tick_input)
+                self.update()
+                tick += 1
+                accumulator -= TICK_TIME
+                self.simulation_steps += 1
+            # Game slows down instead of catching up when ticks take longer than real time
+            accumulator = min(accumulator, TICK_TIME)
+
+            # Leftover time is rendered as a fraction of the next tick
+            self.render(accumulator / TICK_TIME)
+            if self.profiler.enabled:
+                self.profiler.end_frame(self.get_counters())
+            self.clock.tick(self.max_fps)
+
+    def run_headless(self, ticks=None, policy=None):
+        """ Step the simulation as fast as possible without rendering. policy is called every tick with the game and
+            tick number and returns (left, right, jump, dash) input, or None to stop. Without ticks the run lasts until
+            policy stops. Returns a dictionary of run statistics """
+        tick = 0
+        start_time = time.perf_counter()
+        while ticks is None or tick < ticks:
+            tick_input = policy(self, tick) if policy else (False, False, False, False)
+            if tick_input is None:
+                break
+            self.apply_input(*tick_input)
+            self.update()
+            tick += 1
+        elapsed_time = time.perf_counter() - start_time
+
+        return {'ticks': tick, 'seconds': elapsed_time, 'ticks_per_second': tick / elapsed_time if elapsed_time else float('inf')}
+
+
+class RandomPolicy:
+    """ Input policy for headless runs that holds a random direction and randomly jumps and dashes. It has its own
+        generator, so recorded runs replay without it """
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.direction = (False, False)
+
+    def __call__(self, game, tick):
+        if tick % 30 == 0:
+            self.direction = self.rng.choice(((True, False), (False, True), (False, False)))
+        return self.direction[0], self.direction[1], self.rng.random() < 0.05, self.rng.random() < 0.02
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PyNinja')
+    parser.add_argument('--headless', action='store_true', help='run the simulation without window, audio or rendering')
+    parser.add_argument('--ticks', type=int, default=10000, help='number of ticks to simulate in headless mode')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the random number generator')
+    parser.add_argument('--profile', action='store_true', help='record frame timings and dump them to profiles/ on hitches')
+    parser.add_argument('--scaling', choices=SCALING_MODES, default='stretch', help='how the viewport is scaled to the window')
+    parser.add_argument('--fullscreen', action='store_true', help='start in fullscreen')
+    parser.add_argument('--fps', type=int, default=60, help='render rate cap, 0 renders as fast as possible')
+    parser.add_argument('--dirty-rendering', action='store_true', help='redraw and present only areas that changed while the camera rests')
+    parser.add_argument('--batch-physics', action='store_true', help='move enemies through the tilemap in one vectorized step when there are enough of them to pay off')
+    parser.add_argument('--lod', action='store_true', help='update enemies far from the view at a reduced rate and freeze the farthest')
+    parser.add_argument('--stream', action='store_true', help='page grid chunks of the map in and out instead of loading it whole')
+    parser.add_argument('--stream-budget', type=float, default=16, help='memory budget of streamed chunks in MiB')
+    parser.add_argument('--level', type=int, default=0, help='level to start at')
+    parser.add_argument('--record', metavar='PATH', help='record input of the session to a replay file')
+    parser.add_argument('--replay', metavar='PATH', help='play back a replay file, as fast as possible with --headless')
+    args = parser.parse_args()
+    world_options = {'streaming': args.stream, 'stream_budget': int(args.stream_budget * 1024 * 1024), 'lod': args.lod}
+
+    if args.replay:
+        replay = ReplayReader(args.replay)
+        # Options changing the simulation are the recorded ones, whatever the command line asks for
+        world_options['lod'] = replay.lod
+        if args.headless:
+            game = Game(headless=True, seed=replay.seed, level=replay.level, batch_physics=replay.batch_physics, **world_options)
+            stats = game.run_headless(policy=replay)
+            print(f"{stats['ticks']} ticks in {stats['seconds']:.2f}s ({stats['ticks_per_second']:.0f} ticks/s)")
+        else:
+            Game(seed=replay.seed, profile=args.profile, scaling=args.scaling, fullscreen=args.fullscreen,
+                 dirty_rendering=args.dirty_rendering, max_fps=args.fps, level=replay.level, batch_physics=replay.batch_physics, **world_options).run(replay)
+        if replay.divergent_tick is None:
+            print(f'{replay.checksums} checksums matched the recording')
+        else:
+            print(f'Replay diverged from the recording after tick {replay.divergent_tick}')
+            sys.exit(1)
+    elif args.headless:
+        game = Game(headless=True, seed=args.seed, level=args.level, batch_physics=args.batch_physics, **world_options)
+        if args.record:
+            game.start_recording(args.record)
+        stats = game.run_headless(args.ticks, RandomPolicy(game.seed))
+        game.stop_recording()
+        print(f"{stats['ticks']} ticks in {stats['seconds']:.2f}s ({stats['ticks_per_second']:.0f} ticks/s)")
+    else:
+        game = Game(seed=args.seed, profile=args.profile, scaling=args.scaling, fullscreen=args.fullscreen,
+                    dirty_rendering=args.dirty_rendering, max_fps=args.fps, level=args.level, batch_physics=args.batch_physics, **world_options)
+        if args.record:
+            game.start_recording(args.record)
+        game.run()
@@ -1,24 +1,31 @@
+import pygame
+
+
 class Animation:
-    """ Class for sprite animations """
-    def __init__(self, sprites, sprite_duration=5, loop=True):
+    """ Immutable sprite animation clip shared by everything that plays it. Playback state is just a frame number kept
+        by the player of the clip, which is advanced with next_frames and drawn with get_frame_sprite """
+    def __init__(self, sprites, sprite_duration=5, loop=True, flipped_sprites=None):
         self.sprites = sprites
+        # Horizontally flipped sprites are built once, so rendering never flips a surface
+        if flipped_sprites is None:
+            flipped_sprites = [pygame.transform.flip(sprite, True, False) for sprite in sprites]
+        self.flipped_sprites = flipped_sprites
         self.sprite_duration = sprite_duration
         self.loop = loop
-        self.completed = False
-        self.current_frame = 0
 
-    def copy(self):
-        """ Returns a copy of current object """
-        return Animation(self.sprites, self.sprite_duration, self.loop)
+        self.frame_count = sprite_duration * len(sprites)
+        self.last_frame = self.frame_count - 1
 
-    def update(self):
-        if self.loop:
-            self.current_frame = (self.current_frame + 1) % (self.sprite_duration * len(self.sprites))
-        else:
-            self.current_frame = min(self.current_frame + 1, self.sprite_duration * len(self.sprites) - 1)
-            if self.current_frame >= self.sprite_duration * len(self.sprites) - 1:
-                self.completed = True
+        # Sprite of every frame, so finding the sprite of a frame is a lookup instead of a division
+        self.frame_sprites = tuple(sprites[frame // sprite_duration] for frame in range(self.frame_count))
+        self.flipped_frame_sprites = tuple(flipped_sprites[frame // sprite_duration] for frame in range(self.frame_count))
+        # Frame following every frame. Looping clips wrap around to the first frame, others stay on their last frame
+        self.next_frames = tuple(range(1, self.frame_count)) + ((0,) if loop else (self.last_frame,))
+        # Whether the clip has completed on every frame, which only the last frame of a non-looping clip has
+        self.completed_frames = (False,) * self.last_frame + (not loop,)
 
-    def get_frame_sprite(self):
-        """ Return sprite to render for the current frame """
-        return self.sprites[int(self.current_frame / self.sprite_duration)]
+    def get_frame_sprite(self, frame, flip=False):
+        """ Return sprite to render for a frame, flipped horizontally if flip is set """
+        if flip:
+            return self.flipped_frame_sprites[frame]
+        return self.frame_sprites[frame]
@@ -0,0 +1,145 @@
+import os
+import sys
+import struct
+import threading
+from array import array
+
+from scripts.TileGrid import encode_tile, decode_tile
+from scripts.MapFormat import OFFGRID_TILE, load_json_map
+
+# Chunked maps split the grid layers of a map into square chunks, so a streaming tilemap only reads the chunks it needs.
+# Layout (little-endian): header, chunk directory, grid tile ids, offgrid tiles, chunk data. Data of a chunk is its tile id layer
+# (uint16 per cell) followed by its solidity layer (uint8 per cell), both in row-major order
+MAGIC = b'PNCM'
+VERSION = 1
+CHUNKED_EXTENSION = '.cmap'
+
+# magic, version, tile size, chunk size in tiles, chunk count, count of distinct grid tile ids, offgrid tile count
+HEADER = struct.Struct('<4sHHHIHI')
+# chunk x, chunk y, file offset of the chunk data
+CHUNK_ENTRY = struct.Struct('<iiQ')
+
+
+def chunked_map_path(path):
+    """ Returns path of the chunked map generated from a json map """
+    return os.path.splitext(path)[0] + CHUNKED_EXTENSION
+
+
+def save_chunked_map(map_data, path, chunk_size=8):
+    """ Write map data returned by a loader to a chunked map file. Chunks without grid tiles are left out """
+    grid = map_data['grid']
+    cell_count = chunk_size * chunk_size
+
+    chunks = {}
+    for x, y, tile_id in grid:
+        chunk_pos = (x // chunk_size, y // chunk_size)
+        if chunk_pos not in chunks:
+            chunks[chunk_pos] = (array('H', bytes(2 * cell_count)), bytearray(cell_count))
+        tile_ids, solid = chunks[chunk_pos]
+        index = (y - chunk_pos[1] * chunk_size) * chunk_size + x - chunk_pos[0] * chunk_size
+        tile_ids[index] = tile_id
+        solid[index] = grid.is_solid(x, y)
+
+    chunk_positions = sorted(chunks)
+    # Tile ids used by the grid let a reader tell which tiles are in the grid without reading chunks
+    tile_ids = array('H', sorted({tile_id for x, y, tile_id in grid}))
+    if sys.byteorder != 'little':
+        tile_ids.byteswap()
+    data_offset = (HEADER.size + len(chunks) * CHUNK_ENTRY.size + len(tile_ids) * tile_ids.itemsize +
+                   len(map_data['offgrid_tiles']) * OFFGRID_TILE.size)
+
+    map_file = open(path, 'wb')
+    map_file.write(HEADER.pack(MAGIC, VERSION, map_data['tile_size'], chunk_size, len(chunks), len(tile_ids),
+                               len(map_data['offgrid_tiles'])))
+    for i, chunk_pos in enumerate(chunk_positions):
+        map_file.write(CHUNK_ENTRY.pack(chunk_pos[0], chunk_pos[1], data_offset + i * 3 * cell_count))
+    map_file.write(tile_ids.tobytes())
+    for tile in map_data['offgrid_tiles']:
+        map_file.write(OFFGRID_TILE.pack(encode_tile(tile['type'], tile['variant']), tile['pos'][0], tile['pos'][1]))
+    for chunk_pos in chunk_positions:
+        tile_ids, solid = chunks[chunk_pos]
+        if sys.byteorder != 'little':
+            tile_ids.byteswap()
+        map_file.write(tile_ids.tobytes())
+        map_file.write(bytes(solid))
+    map_file.close()
+
+
+class ChunkedMapFile:
+    """ Open chunked map file. Header, chunk directory and offgrid tiles are read up front, and chunks on demand """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+
+        header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            self.file.close()
+            raise ValueError(f'{path} is not a chunked map file')
+        magic, version, self.tile_size, self.chunk_size, chunk_count, tile_id_count, offgrid_count = HEADER.unpack(header)
+        if magic != MAGIC:
+            self.file.close()
+            raise ValueError(f'{path} is not a chunked map file')
+        if version != VERSION:
+            self.file.close()
+            raise ValueError(f'{path} has chunked map version {version}, expected {VERSION}')
+
+        # File offsets of chunk data mapped to chunk position
+        self.chunk_offsets = {}
+        for chunk_x, chunk_y, offset in CHUNK_ENTRY.iter_unpack(self.file.read(chunk_count * CHUNK_ENTRY.size)):
+            self.chunk_offsets[(chunk_x, chunk_y)] = offset
+
+        tile_ids = array('H', self.file.read(tile_id_count * 2))
+        if sys.byteorder != 'little':
+            tile_ids.byteswap()
+        self.grid_tile_ids = set(tile_ids)
+
+        self.offgrid_tiles = []
+        for tile_id, x, y in OFFGRID_TILE.iter_unpack(self.file.read(offgrid_count * OFFGRID_TILE.size)):
+            tile_type, variant = decode_tile(tile_id)
+            self.offgrid_tiles.append({'type': tile_type, 'variant': variant, 'pos': [x, y]})
+
+        # Chunks are read by the game thread and by background loaders, which share the file position
+        self.lock = threading.Lock()
+
+    def read_chunk(self, chunk_pos):
+        """ Returns (tile_ids, solid) arrays of a chunk, or None if the chunk has no grid tiles """
+        offset = self.chunk_offsets.get(chunk_pos)
+        if offset is None:
+            return None
+
+        cell_count = self.chunk_size * self.chunk_size
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(3 * cell_count)
+        if len(data) < 3 * cell_count:
+            raise ValueError(f'{self.path} is truncated')
+
+        tile_ids = array('H', data[:2 * cell_count])
+        if sys.byteorder != 'little':
+            tile_ids.byteswap()
+        return tile_ids, bytearray(data[2 * cell_count:])
+
+    def close(self):
+        self.file.close()
+
+
+def convert_chunked_map(path, chunk_size=8):
+    """ Generate the chunked map of a json map """
+    save_chunked_map(load_json_map(path), chunked_map_path(path), chunk_size)
+
+
+def open_chunked_map(path, chunk_size=8):
+    """ Open the chunked map generated from a json map, generating it first if it is missing or out of date """
+    chunked_path = chunked_map_path(path)
+    if not os.path.exists(chunked_path) or os.path.getmtime(chunked_path) < os.path.getmtime(path):
+        convert_chunked_map(path, chunk_size)
+    return ChunkedMapFile(chunked_path)
+
+
+if __name__ == '__main__':
+    # Usage: python -m scripts.ChunkedMap [map.json ...]. Converts every map in assets/maps by default
+    paths = sys.argv[1:] or [os.path.join('assets/maps', file_name) for file_name in sorted(os.listdir('assets/maps'))
+                             if file_name.endswith('.json')]
+    for map_path in paths:
+        convert_chunked_map(map_path)
+        print(f'{map_path} -> {chunked_map_path(map_path)}')
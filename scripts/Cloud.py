@@ -1,5 +1,8 @@
+import math
 import random
 
+import pygame
+
 
 class Cloud:
     """ Class for a single cloud entity """
@@ -12,22 +15,25 @@ class Cloud:
     def update(self):
         self.pos[0] += self.speed
 
-    def render(self, surface, offset=(0, 0)):
+    def get_render_pos(self, surface_size, offset=(0, 0)):
         # Multiplying pos with z-depth gives parallax effect to clouds
         render_pos = (self.pos[0] - offset[0] * self.z_depth, self.pos[1] - offset[1] * self.z_depth)
 
         # Mod let the clouds loop across screen enabling entity pooling
-        surface.blit(self.cloud_sprite, (render_pos[0] % (surface.get_width() + self.cloud_sprite.get_width()) - self.cloud_sprite.get_width(),
-                                         render_pos[1] % (surface.get_height() + self.cloud_sprite.get_height()) - self.cloud_sprite.get_height()))
+        return (render_pos[0] % (surface_size[0] + self.cloud_sprite.get_width()) - self.cloud_sprite.get_width(),
+                render_pos[1] % (surface_size[1] + self.cloud_sprite.get_height()) - self.cloud_sprite.get_height())
+
+    def render(self, surface, offset=(0, 0)):
+        surface.blit(self.cloud_sprite, self.get_render_pos(surface.get_size(), offset))
 
 
 class Clouds:
     """ Class representing a list of clouds. It is responsible for instantiating and updating each cloud entity """
-    def __init__(self, cloud_sprites, count=12):
+    def __init__(self, cloud_sprites, rng=random, count=12):
         self.clouds = []
 
         for i in range(count):
-            self.clouds.append(Cloud((random.random() * 9999, random.random() * 9999), random.random() * 0.05 + 0.05, random.choice(cloud_sprites), random.random() * 0.6 + 0.2))
+            self.clouds.append(Cloud((rng.random() * 9999, rng.random() * 9999), rng.random() * 0.05 + 0.05, rng.choice(cloud_sprites), rng.random() * 0.6 + 0.2))
 
         # Sort cloud based on z-depth so that clouds in front are rendered over the ones in back
         self.clouds.sort(key=lambda x: x.z_depth)
@@ -36,6 +42,14 @@ class Clouds:
         for cloud in self.clouds:
             cloud.update()
 
+    def get_render_rects(self, surface_size, offset=(0, 0)):
+        """ Returns rects covering every pixel each cloud is drawn on, used to find areas that need redrawing """
+        rects = []
+        for cloud in self.clouds:
+            x, y = cloud.get_render_pos(surface_size, offset)
+            rects.append(pygame.Rect(math.floor(x), math.floor(y), cloud.cloud_sprite.get_width() + 1, cloud.cloud_sprite.get_height() + 1))
+        return rects
+
     def render(self, surface, offset=(0, 0)):
         for cloud in self.clouds:
             cloud.render(surface, offset)
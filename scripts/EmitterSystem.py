@@ -0,0 +1,110 @@
+import heapq
+import pygame
+
+from scripts.SpatialHash import SpatialHash
+
+# Emitters are only active within this many pixels of the view. Leaves drift less than this during their lifetime, so
+# particles of inactive emitters could never be seen
+ACTIVE_MARGIN = 128
+
+
+class Emitter:
+    """ Area that spawns particles at random positions at an average rate """
+    __slots__ = ('rect', 'particle_type', 'rate', 'velocity', 'frames', 'activation')
+
+    def __init__(self, rect, particle_type, rate, velocity=(0, 0), frames=(0, 0)):
+        self.rect = rect
+        self.particle_type = particle_type
+        # Average number of particles spawned per tick
+        self.rate = rate
+        self.velocity = velocity
+        # Inclusive range of the random first animation frame of spawned particles
+        self.frames = frames
+        # Number of times the emitter was activated. Heap entries of an earlier activation are skipped, so
+        # deactivating an emitter doesn't search the heap
+        self.activation = 0
+
+
+class EmitterSystem:
+    """ Ambient particle emitters, e.g. leaves falling from trees. Spawn ticks of active emitters are rolled ahead
+        with exponential intervals of the same average rate as rolling every tick, and kept in a heap, so a tick only
+        costs the spawns that are due. Only emitters near the view are active """
+    def __init__(self, game, margin=ACTIVE_MARGIN):
+        self.game = game
+        self.margin = margin
+
+        self.tick = 0
+        self.emitters = []
+        # Broadphase for finding the emitters near the view
+        self.emitter_hash = SpatialHash(cell_size=128)
+
+        self.active = set()
+        # Heap of (spawn tick, sequence number, emitter, activation)
+        self.spawn_heap = []
+        self.sequence = 0
+        # Area covered by the view when active emitters were last looked up
+        self.active_area = None
+
+    def __len__(self):
+        return len(self.emitters)
+
+    def clear(self):
+        """ Remove every emitter """
+        self.tick = 0
+        self.emitters = []
+        self.emitter_hash.clear()
+        self.active = set()
+        self.spawn_heap = []
+        self.active_area = None
+
+    def spawn(self, rect, particle_type, rate, velocity=(0, 0), frames=(0, 0)):
+        """ Add an emitter spawning particles inside a rect at an average rate per tick """
+        if rate <= 0:
+            raise ValueError(f'Emitter rate must be positive, got {rate}')
+        emitter = Emitter(rect, particle_type, rate, velocity, frames)
+        self.emitters.append(emitter)
+        self.emitter_hash.insert(emitter, rect)
+        self.active_area = None
+
+    def __schedule(self, emitter, start_tick):
+        """ Push the spawn of an emitter following start_tick. Intervals between spawns are exponential, so spawns
+            arrive at the emitter rate like one roll per tick would, and an interval can start at any time """
+        spawn_tick = start_tick + self.game.rng.expovariate(emitter.rate)
+        heapq.heappush(self.spawn_heap, (spawn_tick, self.sequence, emitter, emitter.activation))
+        self.sequence += 1
+
+    def __update_active(self, view_rect):
+        """ Activate emitters near the view and deactivate the ones it left. Emitters are near if they overlap the
+            broadphase cells around the view, so they are only looked up when the view crosses into other cells """
+        area = view_rect.inflate(2 * self.margin, 2 * self.margin)
+        cell_size = self.emitter_hash.cell_size
+        cell_range = (area.left // cell_size, area.top // cell_size, area.right // cell_size, area.bottom // cell_size)
+        if cell_range == self.active_area:
+            return
+        self.active_area = cell_range
+
+        near = self.emitter_hash.query(pygame.Rect(cell_range[0] * cell_size, cell_range[1] * cell_size,
+                                                   (cell_range[2] - cell_range[0] + 1) * cell_size,
+                                                   (cell_range[3] - cell_range[1] + 1) * cell_size))
+        self.active.intersection_update(near)
+        for emitter in near:
+            if emitter not in self.active:
+                emitter.activation += 1
+                self.active.add(emitter)
+                self.__schedule(emitter, self.tick)
+
+    def update(self, view_rect):
+        """ Spawn the particles of active emitters that are due in this tick """
+        self.tick += 1
+        self.__update_active(view_rect)
+
+        rng = self.game.rng
+        spawn_heap = self.spawn_heap
+        while spawn_heap and spawn_heap[0][0] <= self.tick:
+            spawn_tick, sequence, emitter, activation = heapq.heappop(spawn_heap)
+            if activation != emitter.activation or emitter not in self.active:
+                continue
+            rect = emitter.rect
+            pos = (rect.x + rng.random() * rect.width, rect.y + rng.random() * rect.height)
+            self.game.particles.spawn(emitter.particle_type, pos, velocity=emitter.velocity, frame=rng.randint(*emitter.frames))
+            self.__schedule(emitter, spawn_tick)
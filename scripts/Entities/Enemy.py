@@ -1,72 +1,94 @@
-import random
 import math
 
-import pygame
-
-from scripts.Entities.PhysicsEntity import PhysicsEntity
+from scripts.Entities.PhysicsEntity import PhysicsEntity, COLLIDE_BOTTOM
 from scripts.Spark import Spark
-from scripts.ParticleSystem import Particle
+
+# Chance of an idle enemy to start walking on a tick
+WALK_CHANCE = 0.01
 
 
 class Enemy(PhysicsEntity):
     """ Class representing enemy. Inherits from PhysicsEntity """
+    __slots__ = ('walking_timeframe',)
+
     def __init__(self, game, pos, size):
         super().__init__('enemy', game, pos, size)
 
         self.walking_timeframe = 0
 
-    def update(self, tilemap, movement=(0, 0)):
+    def update(self, tilemap, movement=(0, 0), steps=1):
+        """ Update the enemy for a tick, or for several ticks merged into one step """
+        # Merged steps only cover walking on the ground, so an enemy in the air falls tick by tick and can't pass
+        # through tiles
+        if steps > 1 and not self.collisions & COLLIDE_BOTTOM:
+            for i in range(steps):
+                self.update(tilemap, movement)
+            return
+
+        movement = self.pre_physics_update(tilemap, movement, steps)
+        super().update(tilemap, movement=movement)
+        self.post_physics_update(movement)
+
+    def pre_physics_update(self, tilemap, movement=(0, 0), steps=1):
+        """ Walk and shoot. Returns the movement of the tick, or of several merged ticks. Walking distance, walking
+            time and the chance to start walking cover every merged tick, and the ground ahead is checked once """
         if self.walking_timeframe:
+            walking_steps = min(steps, self.walking_timeframe)
             if tilemap.check_solid_tiles_around(self.get_collision_rect().center, self.flip):
-                movement = (movement[0] - 0.5 if self.flip else movement[0] + 0.5, movement[1])
+                movement = (movement[0] - 0.5 * walking_steps if self.flip else movement[0] + 0.5 * walking_steps, movement[1])
             else:
                 self.flip = not self.flip
-            self.walking_timeframe = max(0, self.walking_timeframe - 1)
+            self.walking_timeframe = max(0, self.walking_timeframe - walking_steps)
             if not self.walking_timeframe:
                 distance = (self.game.player.pos[0] - self.pos[0], self.game.player.pos[1] - self.pos[1])
                 # Check if player is at same y-level as enemy
                 if abs(distance[1] < 16):
                     if distance[0] < 0 and self.flip:
                         self.game.sfx['shoot'].play()
-                        self.game.projectiles.append({'pos': [self.get_collision_rect().centerx - 7, self.get_collision_rect().centery], 'velocity': -1.5, 'lifespan': 360})
+                        projectile_pos = (self.get_collision_rect().centerx - 7, self.get_collision_rect().centery)
+                        self.game.projectiles.spawn(projectile_pos, (-1.5, 0), lifespan=360)
                         for i in range(4):
-                            self.game.sparks.append(Spark(self.game.projectiles[-1]['pos'], random.random() - 0.5 + math.pi, random.random() + 2))
+                            self.game.sparks.append(Spark(projectile_pos, self.game.rng.random() - 0.5 + math.pi, self.game.rng.random() + 2))
                     elif distance[0] > 0 and not self.flip:
                         self.game.sfx['shoot'].play()
-                        self.game.projectiles.append({'pos': [self.get_collision_rect().centerx + 7, self.get_collision_rect().centery], 'velocity': 1.5, 'lifespan': 360})
+                        projectile_pos = (self.get_collision_rect().centerx + 7, self.get_collision_rect().centery)
+                        self.game.projectiles.spawn(projectile_pos, (1.5, 0), lifespan=360)
                         for i in range(4):
-                            self.game.sparks.append(Spark(self.game.projectiles[-1]['pos'], random.random() - 0.5, random.random() + 2))
-        elif random.random() < 0.01:
-            self.walking_timeframe = random.randint(30, 120)
-
-        super().update(tilemap, movement=movement)
+                            self.game.sparks.append(Spark(projectile_pos, self.game.rng.random() - 0.5, self.game.rng.random() + 2))
+        elif self.game.rng.random() < (WALK_CHANCE if steps == 1 else 1 - (1 - WALK_CHANCE) ** steps):
+            self.walking_timeframe = self.game.rng.randint(30, 120)
+        return movement
 
+    def post_physics_update(self, movement):
+        """ Update the animation state """
         if movement[0] != 0:
             self.set_animation_state('run')
         else:
             self.set_animation_state('idle')
 
-        if abs(self.game.player.dash_timeframe) >= 50:
-            if self.get_collision_rect().colliderect(self.game.player.get_collision_rect()):
-                self.game.sfx['hit'].play()
-                self.game.screen_shake_strength = max(18, self.game.screen_shake_strength)
-                for i in range(30):
-                    angle = random.random() * math.pi * 2
-                    speed = random.random() * 5
-                    self.game.sparks.append(Spark(self.get_collision_rect().center, angle, 2 + random.random()))
-                    self.game.particles.append(Particle(self.game, 'particle', self.get_collision_rect().center,
-                                                        [math.cos(angle + math.pi) * speed * 0.5, math.sin(angle + math.pi) * speed * 0.5], random.randint(0, 3)))
-                self.game.sparks.append(Spark(self.get_collision_rect().center, 0, 5 + random.random()))
-                self.game.sparks.append(Spark(self.get_collision_rect().center, math.pi, 5 + random.random()))
-                return True
+    def hit(self):
+        """ Burst into sparks and particles when killed by a dashing player """
+        self.game.sfx['hit'].play()
+        self.game.screen_shake_strength = max(18, self.game.screen_shake_strength)
+        for i in range(30):
+            angle = self.game.rng.random() * math.pi * 2
+            speed = self.game.rng.random() * 5
+            self.game.sparks.append(Spark(self.get_collision_rect().center, angle, 2 + self.game.rng.random()))
+            self.game.particles.spawn('particle', self.get_collision_rect().center,
+                                      (math.cos(angle + math.pi) * speed * 0.5, math.sin(angle + math.pi) * speed * 0.5), self.game.rng.randint(0, 3))
+        self.game.sparks.append(Spark(self.get_collision_rect().center, 0, 5 + self.game.rng.random()))
+        self.game.sparks.append(Spark(self.get_collision_rect().center, math.pi, 5 + self.game.rng.random()))
 
-    def render(self, surface, offset=(0, 0)):
-        super().render(surface, offset=offset)
+    def render(self, surface, offset=(0, 0), dirty_rects=None, alpha=1.0):
+        super().render(surface, offset=offset, dirty_rects=dirty_rects, alpha=alpha)
 
+        render_rect = self.get_render_rect(alpha)
         if self.flip:
-            surface.blit(pygame.transform.flip(self.game.assets['gun'], True, False),
-                         (self.get_collision_rect().centerx - 3 - self.game.assets['gun'].get_width() - offset[0],
-                          self.get_collision_rect().centery - offset[1]))
+            rect = surface.blit(self.game.assets['gun/flipped'],
+                                (render_rect.centerx - 3 - self.game.assets['gun'].get_width() - offset[0],
+                                 render_rect.centery - offset[1]))
         else:
-            surface.blit(self.game.assets['gun'], (self.get_collision_rect().centerx + 3 - offset[0],
-                         self.get_collision_rect().centery - offset[1]))
+            rect = surface.blit(self.game.assets['gun'], (render_rect.centerx + 3 - offset[0],
+                                                          render_rect.centery - offset[1]))
+        if dirty_rects is not None:
+            dirty_rects.append(rect)
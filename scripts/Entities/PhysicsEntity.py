@@ -1,12 +1,24 @@
 import pygame
 
+# Bits of the collision bitfield, one per direction
+COLLIDE_TOP = 1
+COLLIDE_RIGHT = 2
+COLLIDE_BOTTOM = 4
+COLLIDE_LEFT = 8
+
 
 class PhysicsEntity:
     """ Class for a game entity that simulates physics """
+    # Slots keep entities compact and attribute access fast, since hundreds of them are updated every tick
+    __slots__ = ('entity_name', 'game', 'pos', 'prev_pos', 'size', 'velocity', 'terminal_velocity_y', 'gravity',
+                 'last_frame_movement', 'collisions', 'rect', 'state', 'flip', 'animation', 'animation_frame', 'anim_offset')
+
     def __init__(self, name, game, pos, size):
         self.entity_name = name
         self.game = game
         self.pos = list(pos)
+        # Position at the start of the last simulation tick. Rendering interpolates between it and pos
+        self.prev_pos = list(pos)
         self.size = size
         self.velocity = [0.0, 0.0]
         self.terminal_velocity_y = 5.0
@@ -14,8 +26,10 @@ class PhysicsEntity:
 
         self.last_frame_movement = [0, 0]
 
-        # Defines collision states in four directions
-        self.collision_states = {'top': False, 'right': False, 'bottom': False, 'left': False}
+        # Bitfield of COLLIDE_ flags of the directions the entity collided in during the last update
+        self.collisions = 0
+        # Collision rect cached at the position, kept in sync whenever the position changes
+        self.rect = pygame.Rect(self.pos, self.size)
 
         # Animation States
         self.state = ''
@@ -24,62 +38,94 @@ class PhysicsEntity:
         self.anim_offset = (-3, -3)
 
     def get_collision_rect(self):
-        """ Return a collision rect at entity position """
-        return pygame.Rect(self.pos, self.size)
+        """ Return the cached collision rect at entity position. It is shared, so callers must not modify it """
+        return self.rect
+
+    def sync_rect(self):
+        """ Move the cached collision rect to the position after it was changed from outside update """
+        # Rect attributes round floats, so positions are truncated toward zero like pygame.Rect(pos, size) does
+        self.rect.x = int(self.pos[0])
+        self.rect.y = int(self.pos[1])
+
+    def get_render_pos(self, alpha=1.0):
+        """ Return position interpolated between the start and the end of the last simulation tick """
+        return (self.pos[0] - (self.pos[0] - self.prev_pos[0]) * (1 - alpha),
+                self.pos[1] - (self.pos[1] - self.prev_pos[1]) * (1 - alpha))
+
+    def get_render_rect(self, alpha=1.0):
+        """ Return a collision rect at the interpolated position """
+        return pygame.Rect(self.get_render_pos(alpha), self.size)
 
     def set_animation_state(self, state):
         """ Change animation state to the one passed as string """
         if state != self.state:
             self.state = state
-            self.animation = self.game.assets[self.entity_name + '/' + self.state].copy()
+            # Clips are shared by every entity, which only keeps its own frame of the clip
+            self.animation = self.game.assets[self.entity_name + '/' + self.state]
+            self.animation_frame = 0
 
     def update(self, tilemap, movement=(0, 0)):
+        self.prev_pos[0] = self.pos[0]
+        self.prev_pos[1] = self.pos[1]
+
         frame_movement = (movement[0] + self.velocity[0], movement[1] + self.velocity[1])
 
-        # Reset collision states
-        self.collision_states = {'top': False, 'right': False, 'bottom': False, 'left': False}
+        collisions = 0
+        entity_rect = self.rect
 
         self.pos[0] += frame_movement[0]
-        entity_rect = self.get_collision_rect()
+        entity_rect.x = int(self.pos[0])
         for tile_rect in tilemap.get_collision_rects(self.pos):
             if entity_rect.colliderect(tile_rect):
                 if frame_movement[0] > 0:
                     entity_rect.right = tile_rect.left
-                    self.collision_states['right'] = True
+                    collisions |= COLLIDE_RIGHT
                 if frame_movement[0] < 0:
                     entity_rect.left = tile_rect.right
-                    self.collision_states['left'] = True
+                    collisions |= COLLIDE_LEFT
                 self.pos[0] = entity_rect.x
 
         self.pos[1] += frame_movement[1]
-        entity_rect = self.get_collision_rect()
+        entity_rect.y = int(self.pos[1])
         for tile_rect in tilemap.get_collision_rects(self.pos):
             if entity_rect.colliderect(tile_rect):
                 if frame_movement[1] > 0:
                     entity_rect.bottom = tile_rect.top
-                    self.collision_states['bottom'] = True
+                    collisions |= COLLIDE_BOTTOM
                 if frame_movement[1] < 0:
                     entity_rect.top = tile_rect.bottom
-                    self.collision_states['top'] = True
+                    collisions |= COLLIDE_TOP
                 self.pos[1] = entity_rect.y
-
-        # Flip the entity to face the move direction
-        if movement[0] > 0:
-            self.flip = False
-        elif movement[0] < 0:
-            self.flip = True
+        self.collisions = collisions
 
         # Apply gravity to the entity with a terminal velocity in y-axis
         self.velocity[1] = min(self.terminal_velocity_y, self.velocity[1] + self.gravity)
 
         # Reset the y velocity if entity is colliding at top or bottom
-        if self.collision_states['top'] or self.collision_states['bottom']:
+        if collisions & (COLLIDE_TOP | COLLIDE_BOTTOM):
             self.velocity[1] = 0
 
+        self.finish_update(movement)
+
+    def finish_update(self, movement):
+        """ Update facing, broadphase entry and animation after the entity has moved """
+        # Flip the entity to face the move direction
+        if movement[0] > 0:
+            self.flip = False
+        elif movement[0] < 0:
+            self.flip = True
+
         self.last_frame_movement = movement
 
-        self.animation.update()
+        self.game.entity_hash.move(self, self.rect)
+
+        self.animation_frame = self.animation.next_frames[self.animation_frame]
 
-    def render(self, surface, offset=(0, 0)):
-        surface.blit(pygame.transform.flip(self.animation.get_frame_sprite(), self.flip, False), (self.pos[0] - offset[0] + self.anim_offset[0],
-                                                                                                        self.pos[1] - offset[1]+ self.anim_offset[1]))
+    def render(self, surface, offset=(0, 0), dirty_rects=None, alpha=1.0):
+        """ Blit the current animation frame at the position interpolated by alpha. Drawn area is appended to
+            dirty_rects if it's passed """
+        render_pos = self.get_render_pos(alpha)
+        rect = surface.blit(self.animation.get_frame_sprite(self.animation_frame, self.flip), (render_pos[0] - offset[0] + self.anim_offset[0],
+                                                                         render_pos[1] - offset[1] + self.anim_offset[1]))
+        if dirty_rects is not None:
+            dirty_rects.append(rect)
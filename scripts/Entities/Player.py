@@ -1,12 +1,12 @@
-import random
 import math
 
-from scripts.Entities.PhysicsEntity import PhysicsEntity
-from scripts.ParticleSystem import Particle
+from scripts.Entities.PhysicsEntity import PhysicsEntity, COLLIDE_RIGHT, COLLIDE_BOTTOM, COLLIDE_LEFT
 
 
 class Player(PhysicsEntity):
     """ Class representing player. Inherits from PhysicsEntity """
+    __slots__ = ('dead', 'airborne_time', 'jump_velocity', 'jump_count', 'dash_velocity', 'dash_timeframe', 'wall_slide')
+
     def __init__(self, game, pos, size):
         super().__init__('player', game, pos, size)
 
@@ -57,7 +57,7 @@ class Player(PhysicsEntity):
         super().update(tilemap, movement=movement)
 
         self.airborne_time += 1
-        if self.collision_states['bottom']:
+        if self.collisions & COLLIDE_BOTTOM:
             self.jump_count = 2
             self.airborne_time = 0
 
@@ -67,10 +67,10 @@ class Player(PhysicsEntity):
             self.dead = True
 
         self.wall_slide = False
-        if (self.collision_states['right'] or self.collision_states['left']) and self.airborne_time > 4:
+        if self.collisions & (COLLIDE_RIGHT | COLLIDE_LEFT) and self.airborne_time > 4:
             self.wall_slide = True
             self.velocity[1] = min(self.velocity[1], 0.5)
-            if self.collision_states['right']:
+            if self.collisions & COLLIDE_RIGHT:
                 self.flip = False
             else:
                 self.flip = True
@@ -90,17 +90,17 @@ class Player(PhysicsEntity):
             if abs(self.dash_timeframe) == 51:
                 self.velocity[0] *= 0.1
             # Particle stream while dashing
-            particle_velocity = [abs(self.dash_timeframe) / self.dash_timeframe * random.random() * 3, 0]
-            self.game.particles.append(Particle(self.game, 'particle', self.get_collision_rect().center, velocity=particle_velocity, frame=random.randint(0, 3)))
+            particle_velocity = (abs(self.dash_timeframe) / self.dash_timeframe * self.game.rng.random() * 3, 0)
+            self.game.particles.spawn('particle', self.get_collision_rect().center, velocity=particle_velocity, frame=self.game.rng.randint(0, 3))
         if abs(self.dash_timeframe) in {60, 50}:
             # Particle burst at beginning and end of a dash sequence
             for i in range(10):
                 # Angle in radians
-                angle = random.random() * math.pi * 2
-                speed = random.random() * 0.5 + 0.5
+                angle = self.game.rng.random() * math.pi * 2
+                speed = self.game.rng.random() * 0.5 + 0.5
                 # Calculate velocity vector from an angle in radian
-                particle_velocity = [math.cos(angle) * speed, math.sin(angle) * speed]
-                self.game.particles.append(Particle(self.game, 'particle', self.get_collision_rect().center, velocity=particle_velocity, frame=random.randint(0, 3)))
+                particle_velocity = (math.cos(angle) * speed, math.sin(angle) * speed)
+                self.game.particles.spawn('particle', self.get_collision_rect().center, velocity=particle_velocity, frame=self.game.rng.randint(0, 3))
 
         if self.dash_timeframe > 0:
             self.dash_timeframe = max(0, self.dash_timeframe - 1)
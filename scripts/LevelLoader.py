@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.Tilemap import Tilemap
+
+
+class Level:
+    """ Parsed and indexed level, ready to be swapped in by the game """
+    def __init__(self, game, path):
+        self.path = path
+
+        # Chunks are baked lazily by the main thread when they are first rendered, since surfaces are not created here
+        self.tilemap = Tilemap(game)
+        if game.streaming:
+            self.tilemap.load_streaming_map(path, game.chunk_reader, game.stream_budget)
+        else:
+            self.tilemap.load_map(path, bake=False)
+
+        self.trees = self.tilemap.get_tiles([('large_decor', 2)], destroy=False)
+        self.spawners = self.tilemap.get_tiles([('spawners', 0), ('spawners', 1)], destroy=True)
+
+
+class LevelLoader:
+    """ Prepares levels on a worker thread, so loading a level while playing doesn't stall the frame """
+    def __init__(self, game):
+        self.game = game
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='LevelLoader')
+
+        # Futures of prepared levels mapped to map path. A prepared level is never mutated, so it is reused on respawn
+        self.levels = {}
+
+    def preload(self, path):
+        """ Start preparing a level in the background if it isn't already prepared """
+        if path not in self.levels:
+            self.levels[path] = self.executor.submit(Level, self.game, path)
+
+    def get(self, path):
+        """ Returns a prepared level, waiting for the worker if it is still being prepared """
+        self.preload(path)
+        return self.levels[path].result()
+
+    def keep(self, paths):
+        """ Drop prepared levels other than the ones in paths """
+        for path in list(self.levels):
+            if path not in paths:
+                del self.levels[path]
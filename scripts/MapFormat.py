@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+from scripts.TileGrid import TileGrid, encode_tile, decode_tile
+
+# Binary maps are a compact cache of the json map files, which stay the source of truth used by the level editor.
+# Layout (little-endian): header, tile id layer (uint16 per cell), solidity layer (uint8 per cell), offgrid tiles
+MAGIC = b'PNMP'
+VERSION = 1
+BINARY_EXTENSION = '.bmap'
+
+# magic, version, tile size, grid origin x, grid origin y, grid width, grid height, offgrid tile count
+HEADER = struct.Struct('<4sHHiiIII')
+# tile id, world position x, world position y
+OFFGRID_TILE = struct.Struct('<Hdd')
+
+
+def binary_map_path(path):
+    """ Returns path of the binary map generated from a json map """
+    return os.path.splitext(path)[0] + BINARY_EXTENSION
+
+
+def load_json_map(path):
+    """ Load map data from a json file """
+    map_file = open(path, 'r')
+    map_data = json.load(map_file)
+    map_file.close()
+
+    # Map files store grid tiles as dictionaries mapped to grid position string, which are packed into tile ids
+    grid = TileGrid.from_tiles((tile['pos'][0], tile['pos'][1], encode_tile(tile['type'], tile['variant']))
+                               for tile in map_data['grid_tiles'].values())
+
+    return {'tile_size': map_data['tile_size'], 'grid': grid, 'offgrid_tiles': map_data['offgrid_tiles']}
+
+
+def save_binary_map(map_data, path):
+    """ Write map data returned by a loader to a binary map file """
+    grid = map_data['grid']
+    tile_ids = array('H', grid.tile_ids)
+    if sys.byteorder != 'little':
+        tile_ids.byteswap()
+
+    map_file = open(path, 'wb')
+    map_file.write(HEADER.pack(MAGIC, VERSION, map_data['tile_size'], grid.origin_x, grid.origin_y,
+                               grid.width, grid.height, len(map_data['offgrid_tiles'])))
+    map_file.write(tile_ids.tobytes())
+    map_file.write(bytes(grid.solid))
+    for tile in map_data['offgrid_tiles']:
+        map_file.write(OFFGRID_TILE.pack(encode_tile(tile['type'], tile['variant']), tile['pos'][0], tile['pos'][1]))
+    map_file.close()
+
+
+def load_binary_map(path):
+    """ Load map data from a binary map file. Tile layers are memory-mapped instead of being read into memory """
+    map_file = open(path, 'rb')
+    # Copy-on-write mapping lets the game destroy tiles without touching the file on disk
+    map_buffer = mmap.mmap(map_file.fileno(), 0, access=mmap.ACCESS_COPY)
+    map_file.close()
+
+    if len(map_buffer) < HEADER.size:
+        raise ValueError(f'{path} is not a binary map file')
+    magic, version, tile_size, origin_x, origin_y, width, height, offgrid_count = HEADER.unpack_from(map_buffer)
+    if magic != MAGIC:
+        raise ValueError(f'{path} is not a binary map file')
+    if version != VERSION:
+        raise ValueError(f'{path} has binary map version {version}, expected {VERSION}')
+
+    cell_count = width * height
+    tile_ids_offset = HEADER.size
+    solid_offset = tile_ids_offset + 2 * cell_count
+    offgrid_offset = solid_offset + cell_count
+    if len(map_buffer) != offgrid_offset + offgrid_count * OFFGRID_TILE.size:
+        raise ValueError(f'{path} is truncated')
+
+    map_view = memoryview(map_buffer)
+    if sys.byteorder == 'little':
+        tile_ids = map_view[tile_ids_offset:solid_offset].cast('H')
+    else:
+        tile_ids = array('H', map_view[tile_ids_offset:solid_offset])
+        tile_ids.byteswap()
+    grid = TileGrid.from_buffers((origin_x, origin_y), (width, height), tile_ids, map_view[solid_offset:offgrid_offset])
+
+    offgrid_tiles = []
+    for tile_id, x, y in OFFGRID_TILE.iter_unpack(map_view[offgrid_offset:]):
+        tile_type, variant = decode_tile(tile_id)
+        offgrid_tiles.append({'type': tile_type, 'variant': variant, 'pos': [x, y]})
+
+    return {'tile_size': tile_size, 'grid': grid, 'offgrid_tiles': offgrid_tiles}
+
+
+def load_map(path):
+    """ Load map data from the binary map generated from a json map if it is up to date, otherwise from the json map """
+    binary_path = binary_map_path(path)
+    if os.path.exists(binary_path) and os.path.getmtime(binary_path) >= os.path.getmtime(path):
+        try:
+            return load_binary_map(binary_path)
+        except ValueError:
+            pass
+    return load_json_map(path)
+
+
+def convert_map(path):
+    """ Generate the binary map of a json map """
+    save_binary_map(load_json_map(path), binary_map_path(path))
+
+
+if __name__ == '__main__':
+    # Usage: python -m scripts.MapFormat [map.json ...]. Converts every map in assets/maps by default
+    paths = sys.argv[1:] or [os.path.join('assets/maps', file_name) for file_name in sorted(os.listdir('assets/maps'))
+                             if file_name.endswith('.json')]
+    for map_path in paths:
+        convert_map(map_path)
+        print(f'{map_path} -> {binary_map_path(map_path)}')
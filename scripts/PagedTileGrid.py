@@ -0,0 +1,171 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from scripts.TileGrid import EMPTY_TILE
+
+
+class PagedTileGrid:
+    """ Tile grid of a chunked map file that keeps recently used chunks in memory as pages and evicts the least
+        recently used ones beyond a memory budget. Has the query interface of TileGrid. A query on a missing chunk reads
+        it right away, and kept chunks are read on a background thread """
+    def __init__(self, map_file, executor, memory_budget=16 * 1024 * 1024, page_overhead=0, on_evict=None):
+        self.map_file = map_file
+        self.chunk_size = map_file.chunk_size
+        self.executor = executor
+        self.memory_budget = memory_budget
+        # Memory of a page is both tile layers plus page_overhead, e.g. the baked surface of its chunk
+        self.page_memory = 3 * self.chunk_size * self.chunk_size + page_overhead
+        # Called with the chunk position of every evicted page
+        self.on_evict = on_evict
+
+        # Resident pages of (tile_ids, solid) mapped to chunk position, least recently used first. Queries don't reorder
+        # pages, since they run for every tile an entity touches. A page is used when it's read, and until it's unpinned
+        self.pages = OrderedDict()
+        # Background reads mapped to chunk position. Their pages are added by the game thread once they finish
+        self.pending = {}
+        # Chunks that are never evicted, e.g. the ones around the camera and entities
+        self.pinned = set()
+        # Cell indices of destroyed tiles mapped to chunk position, applied to pages whenever they are read
+        self.removed = {}
+
+        self.sync_reads = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return sum(1 for tile in self)
+
+    def __iter__(self):
+        """ Yields (x, y, tile_id) for every non-empty cell. Chunks that aren't resident are read without caching them """
+        for chunk_pos in self.map_file.chunk_offsets:
+            page = self.pages.get(chunk_pos)
+            if page is None:
+                page = self.__apply_removed(chunk_pos, self.map_file.read_chunk(chunk_pos))
+            for index, tile_id in enumerate(page[0]):
+                if tile_id:
+                    yield chunk_pos[0] * self.chunk_size + index % self.chunk_size, chunk_pos[1] * self.chunk_size + index // self.chunk_size, tile_id
+
+    def chunk_positions(self):
+        """ Returns positions of every chunk with grid tiles """
+        return self.map_file.chunk_offsets.keys()
+
+    @property
+    def memory_used(self):
+        return len(self.pages) * self.page_memory
+
+    def __apply_removed(self, chunk_pos, page):
+        for index in self.removed.get(chunk_pos, ()):
+            page[0][index] = EMPTY_TILE
+            page[1][index] = 0
+        return page
+
+    def __add_page(self, chunk_pos, page):
+        self.pages[chunk_pos] = self.__apply_removed(chunk_pos, page)
+        self.__evict()
+
+    def __evict(self):
+        """ Drop least recently used pages that aren't pinned until pages fit in the memory budget. The most recent
+            page is kept, since it was just read for a query """
+        if self.memory_used <= self.memory_budget:
+            return
+        for chunk_pos in list(self.pages)[:-1]:
+            if self.memory_used <= self.memory_budget:
+                break
+            if chunk_pos not in self.pinned:
+                del self.pages[chunk_pos]
+                self.evictions += 1
+                if self.on_evict:
+                    self.on_evict(chunk_pos)
+
+    def __collect_reads(self):
+        """ Add pages of finished background reads """
+        for chunk_pos, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[chunk_pos]
+                if chunk_pos not in self.pages:
+                    self.__add_page(chunk_pos, future.result())
+
+    def __get_page(self, chunk_x, chunk_y):
+        """ Returns the page of a chunk, reading it if it isn't resident, or None if the chunk has no grid tiles """
+        chunk_pos = (chunk_x, chunk_y)
+        page = self.pages.get(chunk_pos)
+        if page is not None:
+            return page
+        if chunk_pos not in self.map_file.chunk_offsets:
+            return None
+
+        # Missing chunk is needed now, so it's read on this thread unless a background read already started
+        future = self.pending.pop(chunk_pos, None)
+        if future:
+            page = future.result()
+        else:
+            page = self.map_file.read_chunk(chunk_pos)
+            self.sync_reads += 1
+        self.__add_page(chunk_pos, page)
+        return page
+
+    def keep(self, chunk_positions):
+        """ Replace the set of pinned chunks and start background reads of the ones that aren't resident """
+        self.__collect_reads()
+        if chunk_positions == self.pinned:
+            return
+
+        # Chunks leaving the pinned set were in use until now, so their pages become the most recently used
+        for chunk_pos in self.pinned - chunk_positions:
+            if chunk_pos in self.pages:
+                self.pages.move_to_end(chunk_pos)
+        self.pinned = chunk_positions
+
+        for chunk_pos in chunk_positions:
+            if chunk_pos not in self.pages and chunk_pos not in self.pending and chunk_pos in self.map_file.chunk_offsets:
+                self.pending[chunk_pos] = self.executor.submit(self.map_file.read_chunk, chunk_pos)
+        self.__evict()
+
+    def get(self, x, y):
+        """ Returns tile id at a grid position """
+        chunk_x, local_x = divmod(x, self.chunk_size)
+        chunk_y, local_y = divmod(y, self.chunk_size)
+        page = self.pages.get((chunk_x, chunk_y)) or self.__get_page(chunk_x, chunk_y)
+        if page is None:
+            return EMPTY_TILE
+        return page[0][local_y * self.chunk_size + local_x]
+
+    def is_solid(self, x, y):
+        """ Check if tile at a grid position is a physics tile """
+        chunk_x, local_x = divmod(x, self.chunk_size)
+        chunk_y, local_y = divmod(y, self.chunk_size)
+        # Resident pages are looked up inline, since this runs for every tile an entity touches
+        page = self.pages.get((chunk_x, chunk_y)) or self.__get_page(chunk_x, chunk_y)
+        if page is None:
+            return False
+        return page[1][local_y * self.chunk_size + local_x] == 1
+
+    def are_solid(self, x, y):
+        """ Vectorized is_solid for numpy arrays of grid positions. Returns a boolean array """
+        chunk_x = np.floor_divide(x, self.chunk_size)
+        chunk_y = np.floor_divide(y, self.chunk_size)
+        indices = (y - chunk_y * self.chunk_size) * self.chunk_size + x - chunk_x * self.chunk_size
+        solid = np.zeros(np.shape(x), dtype=bool)
+        if not solid.size:
+            return solid
+
+        # Positions are grouped by chunk, so every chunk is looked up once
+        chunks, chunk_indices = np.unique(np.stack((chunk_x.ravel(), chunk_y.ravel()), axis=1), axis=0, return_inverse=True)
+        chunk_indices = chunk_indices.reshape(solid.shape)
+        for i, (current_x, current_y) in enumerate(chunks.tolist()):
+            page = self.__get_page(current_x, current_y)
+            if page is not None:
+                in_chunk = chunk_indices == i
+                solid[in_chunk] = np.frombuffer(page[1], dtype=np.uint8)[indices[in_chunk]] == 1
+        return solid
+
+    def remove(self, x, y):
+        """ Clear the tile at a grid position. The chunk file is left untouched """
+        chunk_x, local_x = divmod(x, self.chunk_size)
+        chunk_y, local_y = divmod(y, self.chunk_size)
+        index = local_y * self.chunk_size + local_x
+        self.removed.setdefault((chunk_x, chunk_y), set()).add(index)
+        page = self.pages.get((chunk_x, chunk_y))
+        if page is not None:
+            page[0][index] = EMPTY_TILE
+            page[1][index] = 0
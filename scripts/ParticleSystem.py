@@ -1,24 +1,118 @@
-class Particle:
-    def __init__(self, game, particle_type, pos, velocity=[0, 0], frame=0):
+import numpy as np
+
+# Particle types, each animated by the 'particle/<type>' asset. Index in this tuple is the type id stored per particle
+PARTICLE_TYPES = ('leaf', 'particle')
+# Particle types that sway horizontally while they fall
+SWAYING_PARTICLES = {'leaf'}
+
+
+class ParticleSystem:
+    """ Particle engine that stores every live particle in preallocated numpy arrays and updates them in batch """
+    def __init__(self, game, capacity=4096):
         self.game = game
-        self.type = particle_type
-        self.pos = list(pos)
-        self.velocity = list(velocity)
-        self.animation = self.game.assets['particle/' + particle_type].copy()
-        self.animation.current_frame = frame
+        self.capacity = capacity
+
+        # Live particles are packed at the start of the arrays
+        self.count = 0
+        self.pos = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.frame = np.zeros(capacity, dtype=np.int32)
+        self.type = np.zeros(capacity, dtype=np.int32)
+
+        # Per type animation data. Frame tables of every type are flattened into one table indexed by frame_base + frame,
+        # and sprites of every type into one table indexed by the frame_sprites entries
+        self.type_ids = {}
+        self.sprite_table = []
+        frame_base, last_frame, frame_sprites, next_frames, completed_frames, half_size, sway = [], [], [], [], [], [], []
+        for type_id, particle_type in enumerate(PARTICLE_TYPES):
+            animation = game.assets['particle/' + particle_type]
+            self.type_ids[particle_type] = type_id
+            frame_base.append(len(next_frames))
+            last_frame.append(animation.last_frame)
+            frame_sprites.extend(len(self.sprite_table) + frame // animation.sprite_duration for frame in range(animation.frame_count))
+            next_frames.extend(animation.next_frames)
+            completed_frames.extend(animation.completed_frames)
+            self.sprite_table.extend(animation.sprites)
+            half_size.append((animation.sprites[0].get_width() // 2, animation.sprites[0].get_height() // 2))
+            sway.append(particle_type in SWAYING_PARTICLES)
+
+        self.frame_base = np.array(frame_base, dtype=np.int32)
+        self.last_frame = np.array(last_frame, dtype=np.int32)
+        self.frame_sprites = np.array(frame_sprites, dtype=np.int32)
+        self.next_frames = np.array(next_frames, dtype=np.int32)
+        self.completed_frames = np.array(completed_frames)
+        self.half_size = np.array(half_size, dtype=np.int32)
+        self.sway = np.array(sway)
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        """ Remove every particle """
+        self.count = 0
+
+    def spawn(self, particle_type, pos, velocity=(0, 0), frame=0):
+        """ Add a particle. Particles spawned while the system is full are dropped """
+        if self.count == self.capacity:
+            return
+        index = self.count
+        self.pos[index] = pos
+        self.velocity[index] = velocity
+        type_id = self.type_ids[particle_type]
+        # Frames past the end of the clip would index the tables of the next type. They are completed either way
+        self.frame[index] = min(frame, self.last_frame[type_id])
+        self.type[index] = type_id
+        self.count += 1
 
     def update(self):
-        destroy = False
-        if self.animation.completed:
-            destroy = True
+        """ Move and animate every particle, then remove particles whose animation has completed """
+        count = self.count
+        if not count:
+            return
+
+        types = self.type[:count]
+        frame = self.frame[:count]
+        frame_index = self.frame_base[types] + frame
+
+        # Completion and the next frame are looked up in the frame tables, so looping and non-looping clips take the
+        # same path
+        destroy = self.completed_frames[frame_index]
+
+        self.pos[:count] += self.velocity[:count]
+
+        frame[:] = self.next_frames[frame_index]
+
+        # Using property of sine wave to imitate swaying effect on the leaf particles
+        sway = self.sway[types]
+        if sway.any():
+            self.pos[:count, 0] += np.where(sway, np.sin(frame * 0.04) * 0.3, 0)
 
-        self.pos[0] += self.velocity[0]
-        self.pos[1] += self.velocity[1]
+        if destroy.any():
+            # Compact live particles to the start of the arrays in a single pass
+            keep = ~destroy
+            alive = int(np.count_nonzero(keep))
+            self.pos[:alive] = self.pos[:count][keep]
+            self.velocity[:alive] = self.velocity[:count][keep]
+            self.frame[:alive] = frame[keep]
+            self.type[:alive] = types[keep]
+            self.count = alive
 
-        self.animation.update()
+    def render(self, surface, offset=(0, 0), dirty_rects=None):
+        """ Blit every visible particle with a single Surface.blits call. Drawn areas are appended to dirty_rects if
+            it's passed """
+        count = self.count
+        if not count:
+            return
 
-        return destroy
+        types = self.type[:count]
+        sprites = self.frame_sprites[self.frame_base[types] + self.frame[:count]]
+        half_size = self.half_size[types]
+        render_pos = (self.pos[:count] - offset - half_size).astype(np.int32)
 
-    def render(self, surface, offset=(0, 0)):
-        sprite = self.animation.get_frame_sprite()
-        surface.blit(sprite, (self.pos[0] - offset[0] - sprite.get_width() // 2, self.pos[1] - offset[1] - sprite.get_height() // 2))
+        # Skip particles that lie entirely outside the surface
+        visible = ((render_pos > -2 * half_size) & (render_pos < surface.get_size())).all(axis=1)
+        sprite_table = self.sprite_table
+        rects = surface.blits([(sprite_table[sprite], (x, y)) for sprite, (x, y) in zip(sprites[visible].tolist(), render_pos[visible].tolist())],
+                              doreturn=dirty_rects is not None)
+        if dirty_rects is not None:
+            dirty_rects.extend(rects)
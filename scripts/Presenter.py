@@ -0,0 +1,146 @@
+import math
+
+import pygame
+
+# Ways of scaling the viewport to the window:
+# stretch - nearest neighbour scaling to the whole window
+# integer - nearest neighbour scaling by the largest whole factor that fits, centered in the window
+# scale2x - scale2x pixel art filter followed by nearest neighbour scaling to the whole window
+# smooth - bilinear scaling to the whole window
+SCALING_MODES = ('stretch', 'integer', 'scale2x', 'smooth')
+
+
+class Presenter:
+    """ Scales the viewport into preallocated surfaces and presents it in the window. Surfaces are only reallocated
+        when the window size or scaling mode changes """
+    def __init__(self, viewport_size, window_size=(840, 630), scaling='stretch', fullscreen=False):
+        if scaling not in SCALING_MODES:
+            raise ValueError(f'Unknown scaling mode {scaling}, expected one of {", ".join(SCALING_MODES)}')
+        self.viewport_size = viewport_size
+        self.window_size = window_size
+        self.scaling = scaling
+        self.fullscreen = fullscreen
+
+        self.window = None
+        self.scaled_surf = None
+        self.scaled_pos = (0, 0)
+        # Set when the window contents are invalid, so the next frame is presented whole
+        self.needs_full_present = True
+        self.scale2x_surf = pygame.Surface((viewport_size[0] * 2, viewport_size[1] * 2))
+
+        # Transition masks mapped to circle radius. Transitions only use a few radii, so every mask is kept
+        self.transition_masks = {}
+
+        self.set_mode()
+
+    def set_mode(self):
+        """ Create the window for the current window size and fullscreen state """
+        if self.fullscreen:
+            self.window = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+        else:
+            self.window = pygame.display.set_mode(self.window_size, pygame.RESIZABLE)
+        self.allocate()
+
+    def allocate(self):
+        """ Allocate the scaled surface for the current window size and scaling mode """
+        window_width, window_height = self.window.get_size()
+        if self.scaling == 'integer':
+            factor = max(1, min(window_width // self.viewport_size[0], window_height // self.viewport_size[1]))
+            scaled_size = (self.viewport_size[0] * factor, self.viewport_size[1] * factor)
+        else:
+            scaled_size = (window_width, window_height)
+
+        if self.scaled_surf is None or self.scaled_surf.get_size() != scaled_size:
+            self.scaled_surf = pygame.Surface(scaled_size)
+        self.scaled_pos = ((window_width - scaled_size[0]) // 2, (window_height - scaled_size[1]) // 2)
+        self.needs_full_present = True
+
+    def set_scaling(self, scaling):
+        if scaling not in SCALING_MODES:
+            raise ValueError(f'Unknown scaling mode {scaling}, expected one of {", ".join(SCALING_MODES)}')
+        self.scaling = scaling
+        self.allocate()
+
+    def next_scaling(self):
+        """ Switch to the next scaling mode """
+        self.set_scaling(SCALING_MODES[(SCALING_MODES.index(self.scaling) + 1) % len(SCALING_MODES)])
+
+    def toggle_fullscreen(self):
+        self.fullscreen = not self.fullscreen
+        self.set_mode()
+
+    def handle_event(self, event):
+        """ Reallocate surfaces when the window is resized """
+        if event.type == pygame.VIDEORESIZE and not self.fullscreen:
+            self.window_size = event.size
+            self.window = pygame.display.get_surface()
+            self.allocate()
+
+    def get_transition_mask(self, radius):
+        """ Returns a viewport sized mask that covers everything outside a centered circle """
+        if radius not in self.transition_masks:
+            transition_surf = pygame.Surface(self.viewport_size)
+            pygame.draw.circle(transition_surf, (255, 255, 255), (self.viewport_size[0] // 2, self.viewport_size[1] // 2), radius)
+            transition_surf.set_colorkey((255, 255, 255))
+            self.transition_masks[radius] = transition_surf
+        return self.transition_masks[radius]
+
+    def __scale(self, viewport):
+        scaled_size = self.scaled_surf.get_size()
+        if self.scaling == 'smooth':
+            pygame.transform.smoothscale(viewport, scaled_size, self.scaled_surf)
+        elif self.scaling == 'scale2x':
+            pygame.transform.scale2x(viewport, self.scale2x_surf)
+            pygame.transform.scale(self.scale2x_surf, scaled_size, self.scaled_surf)
+        else:
+            pygame.transform.scale(viewport, scaled_size, self.scaled_surf)
+
+    def __present_rects(self, viewport, rects):
+        """ Scale, blit and update only the window areas covering the viewport rects """
+        viewport_rect = viewport.get_rect()
+        scale_x = self.scaled_surf.get_width() / self.viewport_size[0]
+        scale_y = self.scaled_surf.get_height() / self.viewport_size[1]
+
+        if self.scaling == 'integer':
+            # Whole factors map every viewport pixel to the same block of pixels, so rects can be scaled on their own
+            factor = int(scale_x)
+            for rect in rects:
+                rect = rect.clip(viewport_rect)
+                if rect.width and rect.height:
+                    scaled_rect = (rect.x * factor, rect.y * factor, rect.width * factor, rect.height * factor)
+                    pygame.transform.scale(viewport.subsurface(rect), scaled_rect[2:], self.scaled_surf.subsurface(scaled_rect))
+        else:
+            # Filtered and fractional scaling sample neighbouring pixels, so the whole viewport is scaled and the changes
+            # spread a pixel around each rect
+            self.__scale(viewport)
+            rects = [rect.inflate(2, 2) for rect in rects]
+
+        scaled_rect = pygame.Rect(self.scaled_pos, self.scaled_surf.get_size())
+        window_rects = []
+        for rect in rects:
+            # Margin of a pixel covers rounding of fractional scale factors
+            window_rect = pygame.Rect(self.scaled_pos[0] + math.floor(rect.x * scale_x) - 1, self.scaled_pos[1] + math.floor(rect.y * scale_y) - 1,
+                                      math.ceil(rect.width * scale_x) + 2, math.ceil(rect.height * scale_y) + 2).clip(scaled_rect)
+            if window_rect.width and window_rect.height:
+                self.window.blit(self.scaled_surf, window_rect, window_rect.move(-self.scaled_pos[0], -self.scaled_pos[1]))
+                window_rects.append(window_rect)
+
+        pygame.display.update(window_rects)
+
+    def present(self, viewport, offset=(0, 0), rects=None):
+        """ Scale the viewport into the preallocated surface, blit it to the window at an offset and flip the display.
+            Passing a list of viewport rects presents only those areas, offset is ignored then """
+        if rects is not None and not self.needs_full_present:
+            self.__present_rects(viewport, rects)
+            return
+        # Window is shifted by a shake offset, which partial presents can't update
+        self.needs_full_present = offset != (0, 0)
+
+        self.__scale(viewport)
+
+        if self.scaled_pos != (0, 0):
+            # Clear the borders around the letterboxed viewport
+            self.window.fill((0, 0, 0))
+        self.window.blit(self.scaled_surf, (self.scaled_pos[0] + offset[0], self.scaled_pos[1] + offset[1]))
+
+        pygame.display.update()
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+from collections import deque
+
+import pygame
+
+
+class Scope:
+    """ Context manager adding the time spent inside it to a named scope of the current frame """
+    def __init__(self, scope_times, name):
+        self.scope_times = scope_times
+        self.name = name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.scope_times[self.name] = self.scope_times.get(self.name, 0.0) + time.perf_counter() - self.start_time
+
+
+class NullScope:
+    """ Scope returned while the profiler is disabled. Does nothing """
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_SCOPE = NullScope()
+
+
+class Profiler:
+    """ Records time spent in named scopes of every frame into a ring buffer and dumps it to disk when a frame hitches """
+    def __init__(self, enabled=False, history=240, hitch_threshold_ms=50.0, dump_dir='profiles'):
+        self.enabled = enabled
+        self.hitch_threshold_ms = hitch_threshold_ms
+        self.dump_dir = dump_dir
+
+        # Scope times of the frame being recorded, and one scope object per name so recording doesn't allocate them
+        self.scope_times = {}
+        self.scopes = {}
+
+        # Ring buffer of recorded frames. Each frame is a dictionary of frame time, scope times and counters
+        self.frames = deque(maxlen=history)
+        self.frame_start_time = 0.0
+        # Set when a frame started while the profiler was enabled, so enabling it mid-frame doesn't record a bogus frame
+        self.recording_frame = False
+        # Frames left before another hitch can be dumped, so a slow stretch produces one dump
+        self.dump_cooldown = 0
+
+    def scope(self, name):
+        """ Returns a context manager timing a named scope of the current frame """
+        if not self.enabled:
+            return NULL_SCOPE
+        if name not in self.scopes:
+            self.scopes[name] = Scope(self.scope_times, name)
+        return self.scopes[name]
+
+    def begin_frame(self):
+        self.recording_frame = self.enabled
+        if self.enabled:
+            self.scope_times.clear()
+            self.frame_start_time = time.perf_counter()
+
+    def end_frame(self, counters=None):
+        """ Store the recorded frame with optional counters, e.g. live entity counts. Returns path of a hitch dump """
+        if not self.enabled or not self.recording_frame:
+            return None
+
+        frame_ms = (time.perf_counter() - self.frame_start_time) * 1000
+        self.frames.append({'frame_ms': frame_ms,
+                            'scopes_ms': {name: scope_time * 1000 for name, scope_time in self.scope_times.items()},
+                            'counters': counters or {}})
+
+        self.dump_cooldown = max(0, self.dump_cooldown - 1)
+        if frame_ms >= self.hitch_threshold_ms and not self.dump_cooldown:
+            self.dump_cooldown = self.frames.maxlen
+            return self.dump()
+        return None
+
+    def dump(self):
+        """ Write recorded frames to a json file in the dump directory. Returns path of the file """
+        os.makedirs(self.dump_dir, exist_ok=True)
+        path = os.path.join(self.dump_dir, time.strftime('hitch_%Y%m%d_%H%M%S') + f'_{int(time.time() * 1000) % 1000:03d}.json')
+        dump_file = open(path, 'w')
+        json.dump({'hitch_threshold_ms': self.hitch_threshold_ms, 'frames': list(self.frames)}, dump_file, indent=1)
+        dump_file.close()
+        return path
+
+
+class ProfilerOverlay:
+    """ Draws a rolling frame time graph and the counters of the last recorded frame """
+    def __init__(self, profiler, graph_size=(120, 40), target_frame_ms=1000 / 60):
+        self.profiler = profiler
+        self.graph_size = graph_size
+        self.target_frame_ms = target_frame_ms
+        self.visible = False
+        # Profiler keeps recording after the overlay is hidden if it was enabled on its own
+        self.always_record = profiler.enabled
+
+        pygame.font.init()
+        self.font = pygame.font.Font(None, 14)
+
+        self.graph_surf = pygame.Surface(graph_size)
+        self.graph_surf.set_alpha(200)
+
+    def toggle(self):
+        """ Show or hide the overlay. Profiler records frames while the overlay is visible """
+        self.visible = not self.visible
+        self.profiler.enabled = self.visible or self.always_record
+
+    def render(self, surface):
+        if not self.visible or not self.profiler.frames:
+            return
+
+        graph_width, graph_height = self.graph_size
+        # Graph is scaled so the target frame time sits at half of its height
+        ms_to_px = graph_height / (self.target_frame_ms * 2)
+        self.graph_surf.fill((0, 0, 0))
+        frames = self.profiler.frames
+        first_frame = max(0, len(frames) - graph_width)
+        for x in range(len(frames) - first_frame):
+            frame_ms = frames[first_frame + x]['frame_ms']
+            color = (255, 80, 80) if frame_ms > self.target_frame_ms else (80, 255, 80)
+            pygame.draw.line(self.graph_surf, color, (x, graph_height - 1), (x, graph_height - 1 - min(graph_height - 1, int(frame_ms * ms_to_px))))
+        target_y = graph_height - 1 - int(self.target_frame_ms * ms_to_px)
+        pygame.draw.line(self.graph_surf, (255, 255, 255), (0, target_y), (graph_width - 1, target_y))
+        surface.blit(self.graph_surf, (2, 2))
+
+        last_frame = frames[-1]
+        lines = [f"frame {last_frame['frame_ms']:.2f}ms"]
+        lines += [f'{name} {count}' for name, count in last_frame['counters'].items()]
+        for i, line in enumerate(lines):
+            surface.blit(self.font.render(line, False, (255, 255, 255)), (graph_width + 6, 2 + i * 9))
@@ -0,0 +1,140 @@
+import math
+
+import numpy as np
+import pygame
+
+from scripts.SpatialHash import SpatialHash
+
+
+class ProjectileSystem:
+    """ Fixed capacity pool of projectiles with their state stored in numpy arrays """
+    def __init__(self, sprite, capacity=256):
+        self.sprite = sprite
+        self.capacity = capacity
+
+        # Live projectiles are packed at the start of the arrays
+        self.count = 0
+        self.pos = np.zeros((capacity, 2))
+        # Positions at the start of the last simulation tick. Rendering interpolates between them and pos
+        self.prev_pos = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.lifespan = np.zeros(capacity, dtype=np.int32)
+
+        # Every projectile gets an increasing id. Removal keeps the order of live projectiles, so ids stay sorted
+        # and the index of an id can be found with a binary search
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.next_id = 0
+        # Projectile ids mapped to the cells containing them. Entries are only moved when a projectile changes cell
+        self.spatial_hash = SpatialHash()
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        """ Remove every projectile """
+        self.count = 0
+        self.spatial_hash.clear()
+
+    def spawn(self, pos, velocity, lifespan=360):
+        """ Add a projectile. Projectiles spawned while the pool is full are dropped """
+        if self.count == self.capacity:
+            return
+        index = self.count
+        self.pos[index] = pos
+        self.prev_pos[index] = pos
+        self.velocity[index] = velocity
+        self.lifespan[index] = lifespan
+        self.ids[index] = self.next_id
+        # Positions are floored like the cell change test of update, since a rect would truncate negative ones
+        self.spatial_hash.insert(self.next_id, pygame.Rect(math.floor(pos[0]), math.floor(pos[1]), 1, 1))
+        self.next_id += 1
+        self.count += 1
+
+    def __remove(self, remove):
+        """ Remove projectiles flagged in a boolean mask over live projectiles """
+        for projectile_id in self.ids[:self.count][remove].tolist():
+            self.spatial_hash.remove(projectile_id)
+
+        keep = ~remove
+        alive = int(np.count_nonzero(keep))
+        self.pos[:alive] = self.pos[:self.count][keep]
+        self.prev_pos[:alive] = self.prev_pos[:self.count][keep]
+        self.velocity[:alive] = self.velocity[:self.count][keep]
+        self.lifespan[:alive] = self.lifespan[:self.count][keep]
+        self.ids[:alive] = self.ids[:self.count][keep]
+        self.count = alive
+
+    def update(self, tilemap):
+        """ Move projectiles and remove expired ones and the ones hitting a solid tile.
+            Returns a list of (pos, velocity) of projectiles that hit a tile """
+        count = self.count
+        if not count:
+            return []
+
+        pos = self.pos[:count]
+        velocity = self.velocity[:count]
+        self.prev_pos[:count] = pos
+
+        # Sweep the path in steps shorter than a quarter tile, so fast projectiles can't tunnel through tiles
+        max_step = tilemap.tile_size / 4
+        steps = max(1, math.ceil(np.abs(velocity).max() / max_step))
+        hit = np.zeros(count, dtype=bool)
+        hit_pos = pos + velocity
+        for step in range(1, steps + 1):
+            sample_pos = pos + velocity * (step / steps)
+            new_hit = ~hit & tilemap.check_solid_tiles(sample_pos)
+            hit_pos[new_hit] = sample_pos[new_hit]
+            hit |= new_hit
+
+        cell_size = self.spatial_hash.cell_size
+        changed_cell = (np.floor_divide(pos, cell_size) != np.floor_divide(hit_pos, cell_size)).any(axis=1)
+        pos[:] = hit_pos
+        self.lifespan[:count] -= 1
+
+        expired = self.lifespan[:count] <= 0
+        hit &= ~expired
+        impacts = list(zip(pos[hit].tolist(), velocity[hit].tolist()))
+
+        remove = expired | hit
+        for projectile_id, (x, y) in zip(self.ids[:count][changed_cell & ~remove].tolist(), pos[changed_cell & ~remove].tolist()):
+            self.spatial_hash.move(projectile_id, pygame.Rect(math.floor(x), math.floor(y), 1, 1))
+        if remove.any():
+            self.__remove(remove)
+        return impacts
+
+    def collide_rect(self, rect):
+        """ Remove projectiles whose position lies inside a rect. Returns number of removed projectiles """
+        count = self.count
+        if not count:
+            return 0
+
+        # Only projectiles in the cells covered by the rect are tested
+        candidates = self.spatial_hash.query_cells(rect)
+        if not candidates:
+            return 0
+
+        indices = np.searchsorted(self.ids[:count], candidates)
+        pos = self.pos[indices]
+        inside = (pos[:, 0] >= rect.left) & (pos[:, 0] < rect.right) & (pos[:, 1] >= rect.top) & (pos[:, 1] < rect.bottom)
+        hits = int(np.count_nonzero(inside))
+        if hits:
+            remove = np.zeros(count, dtype=bool)
+            remove[indices[inside]] = True
+            self.__remove(remove)
+        return hits
+
+    def render(self, surface, offset=(0, 0), dirty_rects=None, alpha=1.0):
+        """ Blit every projectile at the position interpolated by alpha. Drawn areas are appended to dirty_rects if
+            it's passed """
+        count = self.count
+        if not count:
+            return
+
+        pos = self.pos[:count]
+        if alpha < 1:
+            pos = pos - (pos - self.prev_pos[:count]) * (1 - alpha)
+        render_pos = pos - offset - (self.sprite.get_width() / 2, self.sprite.get_height() / 2)
+        sprite = self.sprite
+        rects = surface.blits([(sprite, pos) for pos in render_pos.tolist()], doreturn=dirty_rects is not None)
+        if dirty_rects is not None:
+            dirty_rects.extend(rects)
@@ -0,0 +1,96 @@
+import struct
+
+# Replay file starts with a header of magic, version, random seed, level, ticks between checksums and simulation
+# option bits. It's followed by one input byte per tick, and a checksum record before the input of every
+# checksum_interval-th tick and at the end
+MAGIC = b'PNRP'
+VERSION = 2
+HEADER = struct.Struct('<4sHqHHB')
+
+# Bits of simulation options that change how the game plays out, so a replay is played back with the same options
+OPTION_BATCH_PHYSICS = 1
+OPTION_LOD = 2
+
+# Bits of an input byte
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+INPUT_DASH = 8
+
+# Checksum records are a tag byte that can't be an input byte followed by a checksum of the game state
+CHECKSUM_TAG = 0x80
+CHECKSUM = struct.Struct('<I')
+
+
+def encode_input(left, right, jump, dash):
+    return (INPUT_LEFT if left else 0) | (INPUT_RIGHT if right else 0) | (INPUT_JUMP if jump else 0) | (INPUT_DASH if dash else 0)
+
+
+def decode_input(bits):
+    return bool(bits & INPUT_LEFT), bool(bits & INPUT_RIGHT), bool(bits & INPUT_JUMP), bool(bits & INPUT_DASH)
+
+
+class ReplayWriter:
+    """ Streams the input of every tick and periodic state checksums of a game to a replay file """
+    def __init__(self, path, seed, level, batch_physics=False, lod=False, checksum_interval=60):
+        self.path = path
+        self.checksum_interval = checksum_interval
+        self.ticks = 0
+
+        options = (OPTION_BATCH_PHYSICS if batch_physics else 0) | (OPTION_LOD if lod else 0)
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, level, checksum_interval, options))
+
+    def record(self, game, left, right, jump, dash):
+        """ Write the input of a tick. Called before the tick is simulated """
+        if self.ticks and self.ticks % self.checksum_interval == 0:
+            self.file.write(bytes((CHECKSUM_TAG,)) + CHECKSUM.pack(game.get_checksum()))
+        self.file.write(bytes((encode_input(left, right, jump, dash),)))
+        self.ticks += 1
+
+    def close(self, game):
+        """ Write the checksum of the final state and close the file """
+        self.file.write(bytes((CHECKSUM_TAG,)) + CHECKSUM.pack(game.get_checksum()))
+        self.file.close()
+
+
+class ReplayReader:
+    """ Input policy that plays back a replay file tick by tick and compares game state with the recorded checksums """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        magic, version, self.seed, self.level, self.checksum_interval, options = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC:
+            self.file.close()
+            raise ValueError(f'{path} is not a replay file')
+        if version != VERSION:
+            self.file.close()
+            raise ValueError(f'{path} has replay version {version}, expected {VERSION}')
+        self.batch_physics = bool(options & OPTION_BATCH_PHYSICS)
+        self.lod = bool(options & OPTION_LOD)
+
+        self.ticks = 0
+        self.checksums = 0
+        # Tick count after which game state first differed from the recording, None while it matches
+        self.divergent_tick = None
+
+    def __verify(self, game):
+        self.checksums += 1
+        if game.get_checksum() != CHECKSUM.unpack(self.file.read(CHECKSUM.size))[0] and self.divergent_tick is None:
+            self.divergent_tick = self.ticks
+
+    def __call__(self, game, tick):
+        """ Returns (left, right, jump, dash) input of the next tick, or None at the end of the replay """
+        if self.file.closed:
+            return None
+
+        record = self.file.read(1)
+        if record and record[0] == CHECKSUM_TAG:
+            self.__verify(game)
+            record = self.file.read(1)
+        if not record:
+            self.file.close()
+            return None
+
+        self.ticks += 1
+        return decode_input(record[0])
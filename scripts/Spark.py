@@ -1,8 +1,15 @@
 import pygame
+import numpy as np
 
 import math
 import random
 
+SPARK_COLOR = (255, 255, 255)
+
+# Bucket sizes used by the sprite cache render mode
+ANGLE_BUCKETS = 64
+SPEED_BUCKET_SIZE = 0.25
+
 
 class Spark:
     """ Represent special effect spawned at projectile impact, gun shoot, and death """
@@ -10,23 +17,124 @@ class Spark:
         self.pos = list(pos)
         self.angle = angle
         self.speed = speed
+        # Unit direction vector is computed once, since the angle of a spark never changes
+        self.direction = (math.cos(angle), math.sin(angle))
 
     def update(self):
-        self.pos[0] += math.cos(self.angle) * self.speed
-        self.pos[1] += math.sin(self.angle) * self.speed
+        self.pos[0] += self.direction[0] * self.speed
+        self.pos[1] += self.direction[1] * self.speed
 
         self.speed = max(0, self.speed - 0.1)
         return not self.speed
 
     def render(self, surface, offset=(0, 0)):
+        # Diamond with its long axis along the direction vector and short axis along the perpendicular vector
+        front = (self.direction[0] * self.speed * 3, self.direction[1] * self.speed * 3)
+        side = (-self.direction[1] * self.speed * 0.5, self.direction[0] * self.speed * 0.5)
         render_points = [
-            (self.pos[0] + math.cos(self.angle) * self.speed * 3 - offset[0],
-             self.pos[1] + math.sin(self.angle) * self.speed * 3 - offset[1]),
-            (self.pos[0] + math.cos(self.angle + math.pi * 0.5) * self.speed * 0.5 - offset[0],
-             self.pos[1] + math.sin(self.angle + math.pi * 0.5) * self.speed * 0.5 - offset[1]),
-            (self.pos[0] + math.cos(self.angle + math.pi) * self.speed * 3 - offset[0],
-             self.pos[1] + math.sin(self.angle + math.pi) * self.speed * 3 - offset[1]),
-            (self.pos[0] + math.cos(self.angle + math.pi * 1.5) * self.speed * 0.5 - offset[0],
-             self.pos[1] + math.sin(self.angle + math.pi * 1.5) * self.speed * 0.5 - offset[1]),
+            (self.pos[0] + front[0] - offset[0], self.pos[1] + front[1] - offset[1]),
+            (self.pos[0] + side[0] - offset[0], self.pos[1] + side[1] - offset[1]),
+            (self.pos[0] - front[0] - offset[0], self.pos[1] - front[1] - offset[1]),
+            (self.pos[0] - side[0] - offset[0], self.pos[1] - side[1] - offset[1]),
         ]
-        pygame.draw.polygon(surface, (255, 255, 255), render_points)
+        pygame.draw.polygon(surface, SPARK_COLOR, render_points)
+
+
+class SparkSystem:
+    """ Stores every live spark in flat numpy arrays and updates and renders them in batch """
+    def __init__(self, capacity=1024, sprite_cache=False):
+        self.capacity = capacity
+        # Draw sparks from pre-rendered sprites bucketed by angle and speed instead of drawing each polygon
+        self.sprite_cache = sprite_cache
+
+        # Live sparks are packed at the start of the arrays
+        self.count = 0
+        self.pos = np.zeros((capacity, 2))
+        self.direction = np.zeros((capacity, 2))
+        self.angle = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+
+        self.sprites = {}
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        """ Remove every spark """
+        self.count = 0
+
+    def spawn(self, pos, angle, speed):
+        """ Add a spark. Sparks spawned while the system is full are dropped """
+        if self.count == self.capacity:
+            return
+        index = self.count
+        self.pos[index] = pos
+        self.angle[index] = angle
+        self.direction[index] = (math.cos(angle), math.sin(angle))
+        self.speed[index] = speed
+        self.count += 1
+
+    def append(self, spark):
+        """ Add a Spark object, so sparks can still be created as Spark(pos, angle, speed) """
+        self.spawn(spark.pos, spark.angle, spark.speed)
+
+    def update(self):
+        """ Move every spark and remove the ones that have stopped """
+        count = self.count
+        if not count:
+            return
+
+        speed = self.speed[:count]
+        self.pos[:count] += self.direction[:count] * speed[:, None]
+        np.maximum(speed - 0.1, 0, out=speed)
+
+        stopped = speed == 0
+        if stopped.any():
+            keep = ~stopped
+            alive = int(np.count_nonzero(keep))
+            self.pos[:alive] = self.pos[:count][keep]
+            self.direction[:alive] = self.direction[:count][keep]
+            self.angle[:alive] = self.angle[:count][keep]
+            self.speed[:alive] = speed[keep]
+            self.count = alive
+
+    def __get_sprite(self, angle_bucket, speed_bucket):
+        """ Returns pre-rendered spark sprite for an angle and speed bucket """
+        key = (angle_bucket, speed_bucket)
+        if key not in self.sprites:
+            spark = Spark((0, 0), angle_bucket * math.pi * 2 / ANGLE_BUCKETS, speed_bucket * SPEED_BUCKET_SIZE)
+            radius = math.ceil(spark.speed * 3) + 1
+            sprite = pygame.Surface((radius * 2, radius * 2))
+            sprite.set_colorkey((0, 0, 0))
+            spark.render(sprite, offset=(-radius, -radius))
+            self.sprites[key] = sprite
+        return self.sprites[key]
+
+    def render(self, surface, offset=(0, 0), dirty_rects=None):
+        """ Draw every spark. Drawn areas are appended to dirty_rects if it's passed """
+        count = self.count
+        if not count:
+            return
+
+        pos = self.pos[:count] - offset
+        if self.sprite_cache:
+            angle_buckets = np.rint(self.angle[:count] * ANGLE_BUCKETS / (math.pi * 2)).astype(np.int32) % ANGLE_BUCKETS
+            speed_buckets = np.rint(self.speed[:count] / SPEED_BUCKET_SIZE).astype(np.int32)
+            blits = []
+            for angle_bucket, speed_bucket, (x, y) in zip(angle_buckets.tolist(), speed_buckets.tolist(), pos.tolist()):
+                sprite = self.__get_sprite(angle_bucket, speed_bucket)
+                blits.append((sprite, (x - sprite.get_width() // 2, y - sprite.get_height() // 2)))
+            rects = surface.blits(blits, doreturn=dirty_rects is not None)
+            if dirty_rects is not None:
+                dirty_rects.extend(rects)
+            return
+
+        # Vertices of every spark polygon are computed in one pass, leaving only the draw calls per spark
+        speed = self.speed[:count, None]
+        front = self.direction[:count] * speed * 3
+        side = self.direction[:count, ::-1] * (-1, 1) * speed * 0.5
+        points = np.stack((pos + front, pos + side, pos - front, pos - side), axis=1).tolist()
+        for render_points in points:
+            rect = pygame.draw.polygon(surface, SPARK_COLOR, render_points)
+            if dirty_rects is not None:
+                dirty_rects.append(rect)
@@ -0,0 +1,82 @@
+class SpatialHash:
+    """ Uniform grid broadphase that maps grid cells to the objects whose rects overlap them """
+    def __init__(self, cell_size=32):
+        self.cell_size = cell_size
+
+        # Objects overlapping a cell mapped to cell position
+        self.cells = {}
+        # Rect and covered cell range (left, top, right, bottom) mapped to object
+        self.objects = {}
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, obj):
+        return obj in self.objects
+
+    def __get_cell_range(self, rect):
+        """ Returns the inclusive range of cells covered by a rect """
+        return (int(rect.left // self.cell_size), int(rect.top // self.cell_size),
+                int((rect.right - 1) // self.cell_size), int((rect.bottom - 1) // self.cell_size))
+
+    def __add_to_cells(self, obj, cell_range):
+        for cell_x in range(cell_range[0], cell_range[2] + 1):
+            for cell_y in range(cell_range[1], cell_range[3] + 1):
+                cell = (cell_x, cell_y)
+                if cell in self.cells:
+                    self.cells[cell].append(obj)
+                else:
+                    self.cells[cell] = [obj]
+
+    def __remove_from_cells(self, obj, cell_range):
+        for cell_x in range(cell_range[0], cell_range[2] + 1):
+            for cell_y in range(cell_range[1], cell_range[3] + 1):
+                cell = (cell_x, cell_y)
+                self.cells[cell].remove(obj)
+                if not self.cells[cell]:
+                    del self.cells[cell]
+
+    def clear(self):
+        """ Remove every object """
+        self.cells = {}
+        self.objects = {}
+
+    def insert(self, obj, rect):
+        """ Add an object occupying a rect """
+        cell_range = self.__get_cell_range(rect)
+        self.objects[obj] = (rect, cell_range)
+        self.__add_to_cells(obj, cell_range)
+
+    def move(self, obj, rect):
+        """ Update rect of an object, inserting it if it isn't in the hash. Cells are only touched when the covered range changes """
+        if obj not in self.objects:
+            self.insert(obj, rect)
+            return
+
+        old_cell_range = self.objects[obj][1]
+        cell_range = self.__get_cell_range(rect)
+        self.objects[obj] = (rect, cell_range)
+        if cell_range != old_cell_range:
+            self.__remove_from_cells(obj, old_cell_range)
+            self.__add_to_cells(obj, cell_range)
+
+    def remove(self, obj):
+        """ Remove an object if it is in the hash """
+        if obj in self.objects:
+            self.__remove_from_cells(obj, self.objects.pop(obj)[1])
+
+    def query_cells(self, rect):
+        """ Returns a list of objects in the cells covered by a rect, without testing their rects """
+        cell_range = self.__get_cell_range(rect)
+        # Objects spanning several cells are only reported once. A dict keeps them in the order they were found
+        found = {}
+        for cell_x in range(cell_range[0], cell_range[2] + 1):
+            for cell_y in range(cell_range[1], cell_range[3] + 1):
+                cell = (cell_x, cell_y)
+                if cell in self.cells:
+                    found.update(dict.fromkeys(self.cells[cell]))
+        return list(found)
+
+    def query(self, rect):
+        """ Returns a list of objects whose rect collides with a rect """
+        return [obj for obj in self.query_cells(rect) if rect.colliderect(self.objects[obj][0])]
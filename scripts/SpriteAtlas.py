@@ -0,0 +1,141 @@
+import os
+import json
+import struct
+
+import pygame
+
+from scripts.Utils import BASE_PATH
+
+# Bumped whenever the packing or the cache file layout changes, which invalidates existing cache files
+CACHE_VERSION = 1
+# Length of the json header at the start of the cache file
+HEADER_LENGTH = struct.Struct('<I')
+
+
+class SpriteAtlas:
+    """ Packs every image under the asset directory into a few atlas pages. Sprites are subsurfaces of the pages.
+        Packed pages are cached on disk as raw pixels with a frame index, and rebuilt when a source image changes """
+    def __init__(self, base_path=BASE_PATH, cache_path='.cache/atlas.bin', page_width=512, max_page_height=2048, padding=1):
+        self.base_path = base_path
+        self.cache_path = cache_path
+        self.page_width = page_width
+        self.max_page_height = max_page_height
+        self.padding = padding
+
+        self.pages = []
+        # Atlas page index and rect of every sprite mapped to its path relative to the asset directory
+        self.frames = {}
+        self.sprites = {}
+
+    def __get_sources(self, directory=''):
+        """ Returns a list of [path, mtime, size] of every image, used to detect stale cache files """
+        sources = []
+        for entry in os.scandir(self.base_path + directory):
+            path = directory + entry.name
+            if entry.is_dir():
+                sources.extend(self.__get_sources(path + '/'))
+            elif entry.name.endswith('.png'):
+                stat = entry.stat()
+                sources.append([path, stat.st_mtime_ns, stat.st_size])
+        return sorted(sources)
+
+    def __pack(self, sources):
+        """ Decode every image and pack them into pages with shelf packing, tallest images first """
+        images = {path: pygame.image.load(self.base_path + path).convert() for path, mtime, size in sources}
+
+        pages = []
+        shelf_x = shelf_y = shelf_height = 0
+        for path in sorted(images, key=lambda image_path: (-images[image_path].get_height(), image_path)):
+            width, height = images[path].get_size()
+            if shelf_x + width > self.page_width:
+                shelf_x = 0
+                shelf_y += shelf_height + self.padding
+                shelf_height = 0
+            if not pages or shelf_y + height > self.max_page_height:
+                pages.append({})
+                shelf_x = shelf_y = shelf_height = 0
+            pages[-1][path] = (shelf_x, shelf_y, width, height)
+            self.frames[path] = (len(pages) - 1, shelf_x, shelf_y, width, height)
+            shelf_x += width + self.padding
+            shelf_height = max(shelf_height, height)
+
+        for page_frames in pages:
+            page_height = max(y + height for x, y, width, height in page_frames.values())
+            page = pygame.Surface((self.page_width, page_height)).convert()
+            page.fill((0, 0, 0))
+            page.blits([(images[path], rect[:2]) for path, rect in page_frames.items()], doreturn=False)
+            self.pages.append(page)
+
+    def __read_cache(self, sources):
+        """ Load pages from the cache file. Returns False if it is missing or stale """
+        if not os.path.exists(self.cache_path):
+            return False
+
+        cache_file = open(self.cache_path, 'rb')
+        cache_data = cache_file.read()
+        cache_file.close()
+
+        if len(cache_data) < HEADER_LENGTH.size:
+            return False
+        header_length = HEADER_LENGTH.unpack_from(cache_data)[0]
+        try:
+            header = json.loads(cache_data[HEADER_LENGTH.size:HEADER_LENGTH.size + header_length])
+        except ValueError:
+            return False
+        if header['version'] != CACHE_VERSION or header['sources'] != sources:
+            return False
+
+        offset = HEADER_LENGTH.size + header_length
+        for width, height in header['pages']:
+            page_size = width * height * 3
+            if offset + page_size > len(cache_data):
+                return False
+            self.pages.append(pygame.image.frombytes(cache_data[offset:offset + page_size], (width, height), 'RGB').convert())
+            offset += page_size
+        self.frames = {path: tuple(frame) for path, frame in header['frames'].items()}
+        return True
+
+    def __write_cache(self, sources):
+        header = json.dumps({'version': CACHE_VERSION, 'sources': sources, 'frames': self.frames,
+                             'pages': [page.get_size() for page in self.pages]}).encode()
+
+        # Cache is written to a temporary file and moved in place, so processes loading the atlas at the same time never
+        # read a partly written cache
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        temp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        cache_file = open(temp_path, 'wb')
+        cache_file.write(HEADER_LENGTH.pack(len(header)))
+        cache_file.write(header)
+        for page in self.pages:
+            cache_file.write(pygame.image.tobytes(page, 'RGB'))
+        cache_file.close()
+        os.replace(temp_path, self.cache_path)
+
+    def load(self):
+        """ Load atlas pages from the cache file, or pack them from the images and update the cache file """
+        self.pages = []
+        self.frames = {}
+        self.sprites = {}
+
+        sources = self.__get_sources()
+        if not self.__read_cache(sources):
+            self.pages = []
+            self.frames = {}
+            self.__pack(sources)
+            self.__write_cache(sources)
+
+        # Subsurfaces inherit the colorkey of their page
+        for page in self.pages:
+            page.set_colorkey((0, 0, 0))
+        for path, (page_index, x, y, width, height) in self.frames.items():
+            self.sprites[path] = self.pages[page_index].subsurface((x, y, width, height))
+
+    def load_sprite(self, path):
+        """ Returns the sprite of an image, like Utils.load_sprite """
+        return self.sprites[path]
+
+    def load_sprites(self, path):
+        """ Returns sprites of every image in a directory sorted by file name, like Utils.load_sprites """
+        prefix = path + '/'
+        return [self.sprites[sprite_path] for sprite_path in sorted(self.sprites)
+                if sprite_path.startswith(prefix) and '/' not in sprite_path[len(prefix):]]
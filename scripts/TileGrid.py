@@ -0,0 +1,118 @@
+from array import array
+
+import numpy as np
+
+# Tile types in the order they are encoded into tile ids. New types must be appended to keep existing ids stable
+TILE_TYPES = ('grass', 'stone', 'decor', 'large_decor', 'spawners')
+PHYSICS_TILES = {'grass', 'stone'}
+
+# Tile id of a grid cell without any tile
+EMPTY_TILE = 0
+
+
+def encode_tile(tile_type, variant):
+    """ Returns the integer tile id of a (type, variant) pair. High byte stores the type and low byte the variant """
+    return (TILE_TYPES.index(tile_type) + 1) << 8 | variant
+
+
+def decode_tile(tile_id):
+    """ Returns the (type, variant) pair of an integer tile id """
+    return TILE_TYPES[(tile_id >> 8) - 1], tile_id & 0xFF
+
+
+class TileGrid:
+    """ Dense grid of tile ids and solidity flags covering the bounding box of a map's grid tiles """
+    def __init__(self, origin=(0, 0), size=(0, 0)):
+        # Grid position of the top-left cell, which can be negative
+        self.origin_x = origin[0]
+        self.origin_y = origin[1]
+        self.width = size[0]
+        self.height = size[1]
+
+        # Cells are stored in row-major order. Solidity is kept in a separate byte array so physics queries
+        # don't have to decode tile ids
+        self.tile_ids = array('H', bytes(2 * self.width * self.height))
+        self.solid = bytearray(self.width * self.height)
+
+    @classmethod
+    def from_tiles(cls, tiles):
+        """ Build a grid from an iterable of (x, y, tile_id) tuples """
+        tiles = list(tiles)
+        if not tiles:
+            return cls()
+
+        min_x = min(tile[0] for tile in tiles)
+        min_y = min(tile[1] for tile in tiles)
+        max_x = max(tile[0] for tile in tiles)
+        max_y = max(tile[1] for tile in tiles)
+
+        grid = cls((min_x, min_y), (max_x - min_x + 1, max_y - min_y + 1))
+        for x, y, tile_id in tiles:
+            grid.set(x, y, tile_id)
+        return grid
+
+    @classmethod
+    def from_buffers(cls, origin, size, tile_ids, solid):
+        """ Build a grid on top of existing tile id and solidity buffers, e.g. memory-mapped from a binary map """
+        grid = cls(origin)
+        grid.width = size[0]
+        grid.height = size[1]
+        grid.tile_ids = tile_ids
+        grid.solid = solid
+        return grid
+
+    def __index(self, x, y):
+        """ Returns array index of a grid position, or -1 if it lies outside the grid """
+        x -= self.origin_x
+        y -= self.origin_y
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return y * self.width + x
+        return -1
+
+    def __iter__(self):
+        """ Yields (x, y, tile_id) for every non-empty cell """
+        for index, tile_id in enumerate(self.tile_ids):
+            if tile_id:
+                yield self.origin_x + index % self.width, self.origin_y + index // self.width, tile_id
+
+    def __len__(self):
+        return sum(1 for tile_id in self.tile_ids if tile_id != EMPTY_TILE)
+
+    def get(self, x, y):
+        """ Returns tile id at a grid position """
+        index = self.__index(x, y)
+        if index < 0:
+            return EMPTY_TILE
+        return self.tile_ids[index]
+
+    def is_solid(self, x, y):
+        """ Check if tile at a grid position is a physics tile """
+        index = self.__index(x, y)
+        if index < 0:
+            return False
+        return self.solid[index] == 1
+
+    def are_solid(self, x, y):
+        """ Vectorized is_solid for numpy arrays of grid positions. Returns a boolean array """
+        x = x - self.origin_x
+        y = y - self.origin_y
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        solid = np.zeros(inside.shape, dtype=bool)
+        if inside.any():
+            solid[inside] = np.frombuffer(self.solid, dtype=np.uint8)[y[inside] * self.width + x[inside]] == 1
+        return solid
+
+    def set(self, x, y, tile_id):
+        """ Place a tile inside the grid bounds """
+        index = self.__index(x, y)
+        if index < 0:
+            raise IndexError(f'Grid position {x};{y} is outside the tile grid')
+        self.tile_ids[index] = tile_id
+        self.solid[index] = tile_id != EMPTY_TILE and decode_tile(tile_id)[0] in PHYSICS_TILES
+
+    def remove(self, x, y):
+        """ Clear the tile at a grid position """
+        index = self.__index(x, y)
+        if index >= 0:
+            self.tile_ids[index] = EMPTY_TILE
+            self.solid[index] = 0
@@ -1,8 +1,19 @@
-import json
+import math
 import pygame
+import numpy as np
+
+from scripts.TileGrid import TileGrid, encode_tile, decode_tile
+from scripts.MapFormat import load_map
+from scripts.ChunkedMap import open_chunked_map
+from scripts.PagedTileGrid import PagedTileGrid
 
 NEIGHBOUR_OFFSETS = [(-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (0, 0)]
-PHYSICS_TILES = {'grass', 'stone'}
+
+# Number of tiles along each side of a pre-rendered chunk
+CHUNK_SIZE = 8
+
+# Ticks of camera movement that streaming reads chunks ahead of
+STREAM_LOOKAHEAD_TICKS = 30
 
 
 class Tilemap:
@@ -11,20 +22,73 @@ class Tilemap:
         self.game = game
         self.tile_size = tile_size
 
-        # Stores tiles that align to the grid. Each tile is stored as a dictionary mapped to grid position string
-        # Since the majority of game world is air, we store tiles in a sparse matrix represented by a dictionary
-        self.grid_tiles = {}
-        self.offgrid_tiles = []
+        # Stores tiles that align to the grid as integer tile ids in a dense array indexed by grid position
+        self.grid = TileGrid()
+        # Offgrid tiles mapped to a key increasing in map order, so a tile can be removed without searching for it
+        self.offgrid_tiles = {}
+
+        # Grid positions and offgrid tile keys mapped to their (type, variant). Dictionaries keep tiles in map order
+        # and remove them in constant time
+        self.grid_tile_index = {}
+        self.offgrid_tile_index = {}
+
+        # Static tiles are baked into chunk surfaces mapped to chunk position, so rendering only blits visible chunks
+        self.chunks = {}
+        self.dirty_chunks = set()
+        # Keys of offgrid tiles overlapping a chunk mapped to chunk position, so baking a chunk doesn't search every
+        # offgrid tile. Dictionaries keep tiles in map order, which is the order they are drawn in
+        self.chunk_offgrid_keys = {}
 
-    def load_map(self, path):
-        """ load map data from a json file """
-        map_file = open(path, 'r')
-        map_data = json.load(map_file)
-        map_file.close()
+        # In streaming mode the grid is paged in from a chunked map file, see load_streaming_map
+        self.streaming = False
+
+    def load_map(self, path, bake=True):
+        """ load map data from a json file, or from its binary map when it is up to date.
+            Without bake, chunks are only marked dirty and baked when they are first rendered """
+        map_data = load_map(path)
 
         self.tile_size = map_data['tile_size']
-        self.grid_tiles = map_data['grid_tiles']
-        self.offgrid_tiles = map_data['offgrid_tiles']
+        self.grid = map_data['grid']
+        self.offgrid_tiles = dict(enumerate(map_data['offgrid_tiles']))
+        self.__build_tile_index()
+
+        self.invalidate_chunks()
+        if bake:
+            self.bake_chunks()
+
+    def load_streaming_map(self, path, executor, memory_budget=16 * 1024 * 1024):
+        """ Load map data from the chunked map of a json file, generating it if it is out of date. Grid chunks are
+            paged in on demand and by background reads of the executor, and the least recently used ones are evicted
+            along with their baked surfaces when pages exceed the memory budget in bytes """
+        map_file = open_chunked_map(path, CHUNK_SIZE)
+        if map_file.chunk_size != CHUNK_SIZE:
+            map_file.close()
+            raise ValueError(f'{map_file.path} has chunk size {map_file.chunk_size}, expected {CHUNK_SIZE}')
+
+        self.tile_size = map_file.tile_size
+        chunk_px = self.tile_size * CHUNK_SIZE
+        # Pages are as large as render chunks, so a page accounts for the baked surface of its chunk as well
+        self.grid = PagedTileGrid(map_file, executor, memory_budget, page_overhead=chunk_px * chunk_px * 4, on_evict=self.__evict_chunk)
+        self.offgrid_tiles = dict(enumerate(map_file.offgrid_tiles))
+        self.streaming = True
+        self.__build_tile_index()
+        self.invalidate_chunks()
+
+    def __build_tile_index(self):
+        # Indexing grid tiles of a streamed map reads every chunk, so it waits for the first query of a grid tile
+        self.grid_tile_index = None if self.streaming else self.__build_grid_tile_index()
+
+        self.offgrid_tile_index = {}
+        for key, tile in self.offgrid_tiles.items():
+            self.offgrid_tile_index.setdefault((tile['type'], tile['variant']), {})[key] = None
+
+    def __build_grid_tile_index(self):
+        grid_tile_index = {}
+        # Streamed grids yield tiles chunk by chunk, so they are sorted into rows first order like TileGrid
+        tiles = sorted(self.grid, key=lambda tile: (tile[1], tile[0])) if self.streaming else self.grid
+        for x, y, tile_id in tiles:
+            grid_tile_index.setdefault(decode_tile(tile_id), {})[(x, y)] = None
+        return grid_tile_index
 
     def __grid_to_world_pos(self, pos):
         """ Returns world position in pixels to a corresponding grid position """
@@ -34,67 +98,176 @@ class Tilemap:
         """ Returns grid position to a corresponding world position in pixels """
         return int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
 
-    def __get_neighbour_tiles(self, pos):
-        """ Returns a list of tiles neighbouring a position """
-        neighbour_tiles = []
-        grid_pos = self.__world_to_grid_pos(pos)
-        for offset in NEIGHBOUR_OFFSETS:
-            check_pos = str(grid_pos[0] + offset[0]) + ';' + str(grid_pos[1] + offset[1])
-            if check_pos in self.grid_tiles:
-                neighbour_tiles.append(self.grid_tiles[check_pos])
-        return neighbour_tiles
+    def __get_offgrid_tile_chunks(self, tile):
+        """ Returns chunk positions overlapped by the sprite of an offgrid tile """
+        chunk_px = self.tile_size * CHUNK_SIZE
+        sprite = self.game.assets[tile['type']][tile['variant']]
+        for chunk_x in range(int(tile['pos'][0] // chunk_px), int((tile['pos'][0] + sprite.get_width() - 1) // chunk_px) + 1):
+            for chunk_y in range(int(tile['pos'][1] // chunk_px), int((tile['pos'][1] + sprite.get_height() - 1) // chunk_px) + 1):
+                yield chunk_x, chunk_y
+
+    def __get_grid_tile_chunk(self, x, y):
+        """ Returns chunk position of a grid tile """
+        return x // CHUNK_SIZE, y // CHUNK_SIZE
+
+    def __bake_chunk(self, chunk_pos):
+        """ Render offgrid and grid tiles overlapping a chunk into its surface """
+        self.dirty_chunks.discard(chunk_pos)
+        chunk_px = self.tile_size * CHUNK_SIZE
+        origin = (chunk_pos[0] * chunk_px, chunk_pos[1] * chunk_px)
+
+        blits = []
+        for key in self.chunk_offgrid_keys.get(chunk_pos, ()):
+            tile = self.offgrid_tiles[key]
+            # Offgrid positions are floored before shifting, so a sprite lines up across chunk borders and lands on the
+            # same pixel as a blit at its world position
+            blits.append((self.game.assets[tile['type']][tile['variant']],
+                          (math.floor(tile['pos'][0]) - origin[0], math.floor(tile['pos'][1]) - origin[1])))
+
+        for x in range(chunk_pos[0] * CHUNK_SIZE, (chunk_pos[0] + 1) * CHUNK_SIZE):
+            for y in range(chunk_pos[1] * CHUNK_SIZE, (chunk_pos[1] + 1) * CHUNK_SIZE):
+                tile_id = self.grid.get(x, y)
+                if tile_id:
+                    tile_type, variant = decode_tile(tile_id)
+                    world_pos = self.__grid_to_world_pos((x, y))
+                    blits.append((self.game.assets[tile_type][variant], (world_pos[0] - origin[0], world_pos[1] - origin[1])))
+
+        if not blits:
+            self.chunks.pop(chunk_pos, None)
+            return
+
+        # Black is the colorkey of every sprite, so the chunk is cleared to black to stay transparent
+        if chunk_pos in self.chunks:
+            chunk_surf = self.chunks[chunk_pos]
+        else:
+            chunk_surf = pygame.Surface((chunk_px, chunk_px))
+        chunk_surf.fill((0, 0, 0))
+        chunk_surf.set_colorkey((0, 0, 0))
+        chunk_surf.blits(blits, doreturn=False)
+        self.chunks[chunk_pos] = chunk_surf
+
+    def invalidate_chunks(self):
+        """ Drop every baked chunk and mark every chunk containing tiles as dirty """
+        self.chunks = {}
+        self.dirty_chunks = set()
+        self.chunk_offgrid_keys = {}
+        for key, tile in self.offgrid_tiles.items():
+            for chunk_pos in self.__get_offgrid_tile_chunks(tile):
+                self.chunk_offgrid_keys.setdefault(chunk_pos, {})[key] = None
+                self.dirty_chunks.add(chunk_pos)
+        if self.streaming:
+            self.dirty_chunks.update(self.grid.chunk_positions())
+        else:
+            for x, y, tile_id in self.grid:
+                self.dirty_chunks.add(self.__get_grid_tile_chunk(x, y))
+
+    def __evict_chunk(self, chunk_pos):
+        """ Drop the baked surface of a chunk whose page was evicted, so it's read and baked again when rendered """
+        if self.chunks.pop(chunk_pos, None):
+            self.dirty_chunks.add(chunk_pos)
+
+    def bake_chunks(self):
+        """ Pre-render every dirty chunk of the map into chunk surfaces """
+        for chunk_pos in self.dirty_chunks.copy():
+            self.__bake_chunk(chunk_pos)
 
     def get_tiles(self, type_variant, destroy=True):
-        """ Return grid and offgrid tiles that matches (type, variant) tuple """
+        """ Return grid and offgrid tiles that matches (type, variant) tuple. Looks up the tile index, so it only
+            visits matching tiles """
+        # Streamed grids are only indexed once a query asks for tiles the grid has
+        if self.grid_tile_index is None and any(encode_tile(*tile_type_variant) in self.grid.map_file.grid_tile_ids
+                                                for tile_type_variant in type_variant):
+            self.grid_tile_index = self.__build_grid_tile_index()
+
+        grid_positions = []
+        offgrid_keys = []
+        for tile_type_variant in dict.fromkeys(type_variant):
+            if self.grid_tile_index is not None:
+                grid_positions.extend(self.grid_tile_index.get(tile_type_variant, ()))
+            offgrid_keys.extend(self.offgrid_tile_index.get(tile_type_variant, ()))
+        # Tiles of several (type, variant) pairs are returned in map order, rows first for grid tiles
+        if len(type_variant) > 1:
+            grid_positions.sort(key=lambda pos: (pos[1], pos[0]))
+            offgrid_keys.sort()
+
         tiles = []
-        for pos in self.grid_tiles:
-            tile = self.grid_tiles[pos]
-            if (tile['type'], tile['variant']) in type_variant:
-                tiles.append(tile.copy())
-                tiles[-1]['pos'] = tiles[-1]['pos'].copy()
-                tiles[-1]['pos'] = self.__grid_to_world_pos(tiles[-1]['pos'])
-                if destroy:
-                    del self.grid_tiles[pos]
-
-        for tile in self.offgrid_tiles.copy():
-            if (tile['type'], tile['variant']) in type_variant:
-                tiles.append(tile.copy())
-                if destroy:
-                    self.offgrid_tiles.remove(tile)
+        for x, y in grid_positions:
+            tile_type, variant = decode_tile(self.grid.get(x, y))
+            tiles.append({'type': tile_type, 'variant': variant, 'pos': self.__grid_to_world_pos((x, y))})
+            if destroy:
+                self.grid.remove(x, y)
+                del self.grid_tile_index[(tile_type, variant)][(x, y)]
+                # Chunks are re-baked lazily the next time they are rendered
+                self.dirty_chunks.add(self.__get_grid_tile_chunk(x, y))
+
+        for key in offgrid_keys:
+            tile = self.offgrid_tiles[key]
+            tiles.append(tile.copy())
+            if destroy:
+                del self.offgrid_tiles[key]
+                del self.offgrid_tile_index[(tile['type'], tile['variant'])][key]
+                for chunk_pos in self.__get_offgrid_tile_chunks(tile):
+                    del self.chunk_offgrid_keys[chunk_pos][key]
+                    self.dirty_chunks.add(chunk_pos)
 
         return tiles
 
     def check_solid_tiles_around(self, pos, flip):
         """ Check for solid tiles down to either sides of the position based on flip """
         grid_pos = self.__world_to_grid_pos((pos[0] - 7 if flip else pos[0] + 7, pos[1] + 23))
-        check_pos = str(grid_pos[0]) + ';' + str(grid_pos[1])
-        if check_pos in self.grid_tiles:
-            if self.grid_tiles[check_pos]['type'] in PHYSICS_TILES:
-                return True
-        return False
+        return self.grid.is_solid(grid_pos[0], grid_pos[1])
 
     def check_solid_tile(self, pos):
         """ Check if tile at pos is a solid tile """
         grid_pos = self.__world_to_grid_pos(pos)
-        check_pos = str(grid_pos[0]) + ';' + str(grid_pos[1])
-        if check_pos in self.grid_tiles:
-            if self.grid_tiles[check_pos]['type'] in PHYSICS_TILES:
-                return True
-        return False
+        return self.grid.is_solid(grid_pos[0], grid_pos[1])
+
+    def check_solid_tiles(self, positions):
+        """ Check solid tiles at an (n, 2) numpy array of positions. Returns a boolean array """
+        grid_pos = np.floor_divide(positions, self.tile_size).astype(np.int64)
+        return self.grid.are_solid(grid_pos[:, 0], grid_pos[:, 1])
 
     def get_collision_rects(self, pos):
         """ Returns a list of collision rects of tiles around a position """
         collision_rects = []
-        for tile in self.__get_neighbour_tiles(pos):
-            if tile['type'] in PHYSICS_TILES:
-                collision_rects.append(pygame.Rect(self.__grid_to_world_pos(tile['pos']), (self.tile_size, self.tile_size)))
+        grid_pos = self.__world_to_grid_pos(pos)
+        for offset in NEIGHBOUR_OFFSETS:
+            check_x = grid_pos[0] + offset[0]
+            check_y = grid_pos[1] + offset[1]
+            if self.grid.is_solid(check_x, check_y):
+                collision_rects.append(pygame.Rect(check_x * self.tile_size, check_y * self.tile_size, self.tile_size, self.tile_size))
         return collision_rects
 
-    def render(self, surf, offset=(0, 0)):
-        for tile in self.offgrid_tiles:
-            surf.blit(self.game.assets[tile['type']][tile['variant']], (tile['pos'][0] - offset[0], tile['pos'][1] - offset[1]))
+    def stream(self, view_rect, velocity=(0, 0), positions=()):
+        """ Keep chunks around the view rect and around world positions, e.g. of entities, paged in while streaming.
+            The view is extended by a chunk on every side and stretched along the camera velocity in pixels per tick,
+            so chunks are read in the background before they scroll into view """
+        if not self.streaming:
+            return
 
-        for tile_key in self.grid_tiles:
-            tile = self.grid_tiles[tile_key]
-            world_pos = self.__grid_to_world_pos(tile['pos'])
-            surf.blit(self.game.assets[tile['type']][tile['variant']], (world_pos[0] - offset[0], world_pos[1] - offset[1]))
+        chunk_px = self.tile_size * CHUNK_SIZE
+        lookahead_x = velocity[0] * STREAM_LOOKAHEAD_TICKS
+        lookahead_y = velocity[1] * STREAM_LOOKAHEAD_TICKS
+        left = int((view_rect.left + min(0, lookahead_x)) // chunk_px) - 1
+        right = int((view_rect.right + max(0, lookahead_x)) // chunk_px) + 1
+        top = int((view_rect.top + min(0, lookahead_y)) // chunk_px) - 1
+        bottom = int((view_rect.bottom + max(0, lookahead_y)) // chunk_px) + 1
+        chunk_positions = {(chunk_x, chunk_y) for chunk_x in range(left, right + 1) for chunk_y in range(top, bottom + 1)}
+
+        # Entities only check tiles next to them, so the chunks around their own chunk are enough
+        for chunk_x, chunk_y in {(int(pos[0] // chunk_px), int(pos[1] // chunk_px)) for pos in positions}:
+            chunk_positions.update((chunk_x + offset_x, chunk_y + offset_y) for offset_x in (-1, 0, 1) for offset_y in (-1, 0, 1))
+
+        self.grid.keep(chunk_positions)
+
+    def render(self, surf, offset=(0, 0)):
+        """ Render chunks that overlap the visible area of the surface """
+        chunk_px = self.tile_size * CHUNK_SIZE
+        offset = (int(offset[0]), int(offset[1]))
+        for chunk_x in range(offset[0] // chunk_px, (offset[0] + surf.get_width()) // chunk_px + 1):
+            for chunk_y in range(offset[1] // chunk_px, (offset[1] + surf.get_height()) // chunk_px + 1):
+                chunk_pos = (chunk_x, chunk_y)
+                if chunk_pos in self.dirty_chunks:
+                    self.__bake_chunk(chunk_pos)
+                if chunk_pos in self.chunks:
+                    surf.blit(self.chunks[chunk_pos], (chunk_x * chunk_px - offset[0], chunk_y * chunk_px - offset[1]))
@@ -0,0 +1,75 @@
+# Entities closer to the view than this many pixels are updated every tick
+NEAR_DISTANCE = 96
+# Entities farther from the view than this many pixels are frozen. Projectiles fly 1.5 pixels per tick for 360 ticks,
+# so a frozen enemy is too far away for a shot of it to ever reach the view
+FREEZE_DISTANCE = 640
+# Entities in between are updated every this many ticks, with the skipped ticks merged into one step
+REDUCED_INTERVAL = 4
+
+
+class UpdateScheduler:
+    """ Level of detail for entity updates. Buckets entities by their distance to the view every tick into full
+        updates, reduced updates that merge several ticks into one step, and frozen entities that don't advance until
+        the view comes closer """
+    def __init__(self, near_distance=NEAR_DISTANCE, freeze_distance=FREEZE_DISTANCE, reduced_interval=REDUCED_INTERVAL):
+        self.near_distance = near_distance
+        self.freeze_distance = freeze_distance
+        self.reduced_interval = reduced_interval
+
+        self.tick = 0
+        # (tick of the last update, phase) of every scheduled entity. Frozen entities are moved along, so freezing
+        # stops time for them instead of piling up ticks to merge. Reduced updates of an entity run on ticks matching
+        # its phase, so they are spread over the interval
+        self.entity_ticks = {}
+
+        # Updates since the counters were last reset, and frozen entities of the last tick
+        self.full_updates = 0
+        self.reduced_updates = 0
+        self.frozen = 0
+
+    def clear(self):
+        """ Forget scheduled entities and start over at the first tick, so phases line up like in a new scheduler """
+        self.tick = 0
+        self.entity_ticks = {}
+
+    def reset_counters(self):
+        self.full_updates = 0
+        self.reduced_updates = 0
+
+    def get_distance(self, entity, view_rect):
+        """ Returns the distance in pixels between the collision rect of an entity and the view rect along the axis
+            where they are farther apart """
+        distance_x = max(view_rect.left - entity.pos[0] - entity.size[0], entity.pos[0] - view_rect.right, 0)
+        distance_y = max(view_rect.top - entity.pos[1] - entity.size[1], entity.pos[1] - view_rect.bottom, 0)
+        return max(distance_x, distance_y)
+
+    def schedule(self, entities, view_rect):
+        """ Advance a tick and pick the entities that are updated in it. Returns a list of entities updated for this
+            tick, and a list of (entity, steps) of entities updated for several ticks at once """
+        self.tick += 1
+        full = []
+        merged = []
+        self.frozen = 0
+
+        entity_ticks = {}
+        for i, entity in enumerate(entities):
+            last_update_tick, phase = self.entity_ticks.get(entity, (self.tick - 1, i % self.reduced_interval))
+            steps = self.tick - last_update_tick
+            distance = self.get_distance(entity, view_rect)
+
+            if distance > self.freeze_distance:
+                self.frozen += 1
+                last_update_tick = self.tick
+            elif distance <= self.near_distance or (self.tick + phase) % self.reduced_interval == 0:
+                # Entities coming closer catch up on the ticks they skipped in one step
+                if steps == 1:
+                    full.append(entity)
+                else:
+                    merged.append((entity, steps))
+                last_update_tick = self.tick
+            entity_ticks[entity] = (last_update_tick, phase)
+        self.entity_ticks = entity_ticks
+
+        self.full_updates += len(full)
+        self.reduced_updates += len(merged)
+        return full, merged
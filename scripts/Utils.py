@@ -17,3 +17,15 @@ def load_sprites(path):
     for file_name in sorted(os.listdir(BASE_PATH + path)):
         sprites.append(load_sprite(path + '/' + file_name))
     return sprites
+
+
+class SilentSound:
+    """ Stand-in for pygame.mixer.Sound used when the game runs without audio """
+    def __init__(self, path):
+        self.path = path
+
+    def play(self, loops=0):
+        pass
+
+    def set_volume(self, volume):
+        pass